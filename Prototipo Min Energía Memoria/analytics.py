@@ -1,4 +1,5 @@
 # analytics.py
+import numpy as np
 import pandas as pd
 
 TRIM_CIERRE = {1:"marzo", 2:"junio", 3:"septiembre", 4:"diciembre"}
@@ -27,60 +28,248 @@ def totales_anuales(df, scope):
         # fallback: suma todo el año (no ideal pero sirve si no hay cierre explícito)
         d_year = d
     agg = d_year.groupby("anio", as_index=False)["monto"].sum().rename(columns={"monto":"total_anual"})
-    return agg.sort_values("anio")
+    return _con_variacion_anual(agg.sort_values("anio"), "total_anual")
 
 # analytics.py
 
-def totales_trimestrales(df, scope):
+MESES = ["enero","febrero","marzo","abril","mayo","junio","julio","agosto","septiembre","octubre","noviembre","diciembre"]
+MES_NUM = {m:i for i,m in enumerate(MESES, start=1)}
+DIMENSIONES = ["anio","capitulo","programa","subtitulo"]
+
+def _desacumular(acc, arrastrar=False):
+    """acc: tabla ancha (filas=grupo, columnas=periodo ordenado) de montos acumulados, NaN si falta.
+    Devuelve flujos por periodo (diferencia con el periodo anterior, >= 0; 0 si falta algún extremo).
+    arrastrar=True: compara con el último periodo observado (el flujo cubre los periodos faltantes)."""
+    if arrastrar:
+        previo = acc.ffill(axis=1).shift(1, axis=1)
+        flujos = (acc - previo.fillna(0)).clip(lower=0)
+    else:
+        flujos = acc.diff(axis=1).clip(lower=0)
+    flujos.iloc[:, 0] = acc.iloc[:, 0]
+    return flujos.fillna(0)
+
+def flujos_por_periodo(df, scope, por=("anio",), periodo="trimestral", arrastrar=None):
+    """
+    Convierte ejecución acumulada en flujos por periodo en una sola pasada (pivot + diff).
+    por: cualquier combinación de DIMENSIONES. periodo: "trimestral" (Q1..Q4) o "mensual" (enero..diciembre).
+    arrastrar: ver `_desacumular`; por defecto solo en mensual (la mayoría de las fuentes son cierres trimestrales).
+    Devuelve una fila por grupo con una columna por periodo + alerta_datos_faltantes.
+    """
+    por = list(por)
+    periodos, etiquetas = _periodos(periodo)
     d = _apply_scope(df, scope)
-    acc = []
-    for q, mes in TRIM_CIERRE.items():
-        tmp = d[d["mes_cierre"]==mes].groupby(["anio"], as_index=False)["monto"].sum()
-        tmp["quarter"] = q
-        tmp = tmp.rename(columns={"monto":"acumulado"})
-        acc.append(tmp)
-    acc = pd.concat(acc, ignore_index=True) if acc else pd.DataFrame(columns=["anio","quarter","acumulado"])
-
-    q1 = acc[acc["quarter"]==1][["anio","acumulado"]].rename(columns={"acumulado":"Q1"})
-    q2 = acc[acc["quarter"]==2][["anio","acumulado"]].rename(columns={"acumulado":"_Q2"})
-    q3 = acc[acc["quarter"]==3][["anio","acumulado"]].rename(columns={"acumulado":"_Q3"})
-    q4 = acc[acc["quarter"]==4][["anio","acumulado"]].rename(columns={"acumulado":"_Q4"})
-    res = q1.merge(q2, on="anio", how="outer").merge(q3, on="anio", how="outer").merge(q4, on="anio", how="outer")
-
-    res["Q2"] = (res["_Q2"] - res["Q1"]).clip(lower=0)
-    res["Q3"] = (res["_Q3"] - res["_Q2"]).clip(lower=0)
-    res["Q4"] = (res["_Q4"] - res["_Q3"]).clip(lower=0)
-    res = res.drop(columns=["_Q2","_Q3","_Q4"]).fillna(0)
-
-    # ✅ move this INSIDE the function
-    res["alerta_datos_faltantes"] = res.apply(
-        lambda r: any(v == 0 for v in [r["Q1"], r["Q2"], r["Q3"], r["Q4"]]),
-        axis=1
-    )
-
-    return res.sort_values("anio")
+    d = d[d["mes_cierre"].isin(periodos.keys())]
+    acc = d.groupby(por + ["mes_cierre"])["monto"].sum()
+    return _tabla_flujos(acc, por, periodo, arrastrar)
+
+def _periodos(periodo):
+    """(mes_cierre → número de periodo, número → etiqueta de columna)."""
+    if periodo == "trimestral":
+        return {mes: q for q, mes in TRIM_CIERRE.items()}, {q: f"Q{q}" for q in TRIM_CIERRE}
+    if periodo == "mensual":
+        return MES_NUM, {i: m for m, i in MES_NUM.items()}
+    raise ValueError(f"periodo no soportado: {periodo}")
+
+def _tabla_flujos(acc, por, periodo, arrastrar=None):
+    """acc: Serie de acumulados indexada por por + [mes_cierre] → tabla ancha de flujos (compartida con analytics_sql)."""
+    if arrastrar is None:
+        arrastrar = periodo == "mensual"
+    periodos, etiquetas = _periodos(periodo)
+    if acc.empty:
+        return pd.DataFrame(columns=por + list(etiquetas.values()) + ["alerta_datos_faltantes", "total"])
+    acc = acc.rename(index=periodos, level="mes_cierre")
+    acc = acc.unstack("mes_cierre").reindex(columns=list(etiquetas))
+    res = _desacumular(acc, arrastrar=arrastrar).rename(columns=etiquetas)
+    res.columns.name = None
+    res["alerta_datos_faltantes"] = (res[list(etiquetas.values())] == 0).any(axis=1)
+    # total del año = acumulado al último cierre (Q4/diciembre), no la suma de flujos: si falta
+    # un periodo intermedio la suma lo pierde; NaN si falta el propio cierre
+    res["total"] = acc[list(etiquetas)[-1]].astype("float64")
+    return res.reset_index().sort_values(por)
+
+def totales_trimestrales(df, scope):
+    return _con_variaciones_periodo(flujos_por_periodo(df, scope, por=["anio"], periodo="trimestral"), ["anio"], "trimestral")
 
 def serie_mensual(df, scope):
     d = _apply_scope(df, scope)
-    order = {m:i for i,m in enumerate(["enero","febrero","marzo","abril","mayo","junio","julio","agosto","septiembre","octubre","noviembre","diciembre"], start=1)}
-    d = d[d["mes_cierre"].isin(order.keys())]
-    d["mes_num"] = d["mes_cierre"].map(order)
-    agg = d.groupby(["anio","mes_num","mes_cierre"], as_index=False)["monto"].sum().sort_values(["anio","mes_num"])
-    return agg.rename(columns={"monto":"acumulado_mes"})
+    d = d[d["mes_cierre"].isin(MES_NUM.keys())]
+    d = d.assign(mes_num=d["mes_cierre"].map(MES_NUM))
+    agg = d.groupby(["anio","mes_num","mes_cierre"], as_index=False)["monto"].sum()
+    return _serie_desde_agg(agg)
+
+def _serie_desde_agg(agg):
+    """agg: anio, mes_num, mes_cierre, monto (acumulado) → serie con flujo_mes (compartida con analytics_sql)."""
+    agg = agg.sort_values(["anio","mes_num"]).rename(columns={"monto":"acumulado_mes"})
+    if agg.empty:
+        serie = agg.assign(flujo_mes=pd.Series(dtype="float64"))
+    else:
+        # flujo del mes = acumulado - último acumulado observado en el año
+        acc = agg.set_index(["anio","mes_num"])["acumulado_mes"].unstack("mes_num").reindex(columns=list(MES_NUM.values()))
+        flujos = _desacumular(acc, arrastrar=True).stack().rename("flujo_mes").reset_index()
+        serie = agg.merge(flujos, on=["anio","mes_num"], how="left")
+    # mismo mes del año anterior (acumulado) y mes anterior observado del mismo año (flujo)
+    serie = _con_variacion_anual(serie, "acumulado_mes", alinear=["mes_num"], nombre="acumulado_var_anual")
+    serie = _agregar_variacion(serie, serie["flujo_mes"], serie.groupby("anio")["flujo_mes"].shift(1), "flujo_var_mes")
+    return serie
+
+# ---------- Variaciones precalculadas (el LLM solo narra; las comparaciones no requieren LLM) ----------
+def _variacion(actual, previo):
+    """(diferencia absoluta, variación %); NaN si no hay base o es 0."""
+    actual, previo = actual.astype("float64"), previo.astype("float64")
+    dif = actual - previo
+    return dif, dif / previo.abs().where(previo != 0) * 100
+
+def _agregar_variacion(tabla, actual, previo, nombre):
+    """Agrega las columnas `nombre` (diferencia) y `nombre`_pct."""
+    dif, pct = _variacion(actual, previo)
+    return tabla.assign(**{nombre: dif, f"{nombre}_pct": pct})
+
+def _previo_anual(tabla, cols, alinear=()):
+    """
+    Valores de `cols` en la fila del año anterior presente en la tabla con las mismas columnas `alinear`
+    (ej. "2021 y 2023" → 2023 vs 2021), más `anio_base` con ese año; NaN si no hay año anterior.
+    """
+    alinear, cols = list(alinear), list(cols)
+    orden = tabla[["anio", *alinear, *cols]].sort_values("anio", kind="stable")
+    previo = orden.groupby(alinear, dropna=False)[["anio", *cols]].shift(1) if alinear else orden[["anio", *cols]].shift(1)
+    previo = previo.rename(columns={"anio": "anio_base"}).reindex(tabla.index)
+    previo["anio_base"] = pd.to_numeric(previo["anio_base"], errors="coerce").astype("Int64")
+    return previo
+
+def _con_variacion_anual(tabla, col, alinear=(), nombre="var_anual"):
+    """YoY de `col`: año vs el año anterior presente en la tabla (columna anio_base)."""
+    previo = _previo_anual(tabla, [col], alinear)
+    return _agregar_variacion(tabla.assign(anio_base=previo["anio_base"]), tabla[col], previo[col], nombre)
+
+def _con_variaciones_periodo(tabla, por, periodo):
+    """
+    Para tablas anchas de flujos (ej. totales_trimestrales): YoY del total del año y, por periodo,
+    diferencia y % vs mismo periodo del año anterior y vs periodo anterior del mismo año.
+    `total` (acumulado al cierre) viene de `_tabla_flujos`; si no está, suma de flujos solo sin datos faltantes.
+    """
+    etiquetas = list(_periodos(periodo)[1].values())
+    alinear = [c for c in por if c != "anio"]
+    if "total" not in tabla:
+        total = tabla[etiquetas].astype("float64").sum(axis=1)
+        if "alerta_datos_faltantes" in tabla:
+            total = total.where(~tabla["alerta_datos_faltantes"].astype(bool))
+        tabla = tabla.assign(total=total)
+    # flujo 0 = periodo faltante (ver alerta_datos_faltantes): sin % en vez de ±100%
+    flujos = tabla[etiquetas].astype("float64")
+    flujos = flujos.where(flujos != 0)
+    previo = _previo_anual(tabla.assign(**flujos), etiquetas, alinear)
+    tabla = _con_variacion_anual(tabla, "total", alinear)
+    nuevas = {}
+    for i, p in enumerate(etiquetas):
+        nuevas[f"{p}_var_anual"], nuevas[f"{p}_var_anual_pct"] = _variacion(flujos[p], previo[p])
+        if i:
+            nuevas[f"{p}_var_periodo"], nuevas[f"{p}_var_periodo_pct"] = _variacion(flujos[p], flujos[etiquetas[i-1]])
+    return tabla.assign(**nuevas)
+
+def _top_k(montos, k):
+    """
+    Posiciones de los k mayores montos (selección parcial, sin ordenar todo), en orden descendente.
+    Empates: gana la posición menor (igual que un sort estable + head, y que ORDER BY monto DESC, clave).
+    """
+    montos = np.asarray(montos, dtype=float)
+    if k <= 0:
+        return np.arange(0)
+    if len(montos) > k:
+        # todos los empatados con el k-ésimo valor entran al desempate (argpartition elige al azar entre ellos)
+        corte = np.partition(-montos, k - 1)[k - 1]
+        idx = np.flatnonzero(-montos <= corte)
+    else:
+        idx = np.arange(len(montos))
+    return idx[np.lexsort((idx, -montos[idx]))][:k]
+
+def _top_k_por_grupo(grp, clave, k):
+    pos = [ix[_top_k(grp["monto"].to_numpy()[ix], k)] for _, ix in sorted(grp.groupby(clave).indices.items())]
+    return grp.iloc[np.concatenate(pos)] if pos else grp
 
 def desglose_por_denominacion(df, scope, top=20, periodo="anual"):
     d = _apply_scope(df, scope)
-    if periodo=="anual":
-        d = d[d["mes_cierre"]=="diciembre"] if "mes_cierre" in d.columns else d
-        grp = d.groupby(["anio","denominacion"], as_index=False)["monto"].sum()
-        grp = grp.sort_values(["anio","monto"], ascending=[True, False])
-        return grp.groupby("anio").head(top)
-    elif periodo=="q4":
+    if periodo in ("anual", "q4") and "mes_cierre" in d.columns:
         d = d[d["mes_cierre"]=="diciembre"]
-        return d.groupby(["anio","denominacion"], as_index=False)["monto"].sum().sort_values(["anio","monto"], ascending=[True, False]).groupby("anio").head(top)
-    else:
-        # genérico
-        return d.groupby(["anio","denominacion"], as_index=False)["monto"].sum().sort_values(["anio","monto"], ascending=[True, False]).groupby("anio").head(top)
+    grp = d.groupby(["anio","denominacion"], as_index=False)["monto"].sum()
+    return _top_k_por_grupo(grp, "anio", top).reset_index(drop=True)
+
+# ---------- Jerarquía del clasificador (subtítulo → ítem → asignación → sub-asignación) ----------
+NIVELES = ["subtitulo","item","asignacion","sub_asignacion"]
+
+def _codigos_clasificador(d, niveles):
+    """Códigos como texto ('' si vacío), truncados al primer nivel vacío (fila = nodo de esa profundidad)."""
+    cods = pd.DataFrame(index=d.index)
+    for n in niveles:
+        col = d[n]
+        if n == "subtitulo":
+            col = col.astype("Int64")
+        cods[n] = col.astype("string").fillna("").str.strip()
+    lleno = (cods != "").astype(int).cumprod(axis=1).astype(bool)
+    return cods.where(lleno, "")
+
+def construir_jerarquia(df, scope=None, por=("anio","capitulo","programa"), niveles=NIVELES, top=20):
+    """
+    Precalcula rollups al cierre anual (diciembre) sobre el árbol del clasificador.
+    Cada nodo guarda su monto (fila explícita de la fuente si existe; si no, suma de sus hijos)
+    y sus top-k hijos elegidos por selección parcial. Se recorre el DF una sola vez;
+    `expandir_nodo` navega después sin volver a tocar las filas.
+    """
+    por, niveles = list(por), list(niveles)
+    d = _apply_scope(df, scope or {})
+    d = d[d["mes_cierre"]=="diciembre"]
+    return _jerarquia_desde_filas(d, por, niveles, top)
+
+def _jerarquia_desde_filas(d, por, niveles, top):
+    """d: filas (o agregados por por + niveles, en el orden de la fuente) con denominacion y monto (compartida con analytics_sql)."""
+    d = pd.concat([d[por + ["denominacion","monto"]], _codigos_clasificador(d, niveles)], axis=1)
+    agg = d.groupby(por + niveles, dropna=False).agg(monto=("monto","sum"), denominacion=("denominacion","first")).reset_index()
+
+    nodos = {}
+    def _nodo(clave, ruta):
+        return nodos.setdefault((clave, ruta), {"monto_explicito": None, "denominacion": "", "hijos": set()})
+
+    for r in agg.itertuples(index=False):
+        clave = tuple(str(v).lower() if isinstance(v, str) else v for v in r[:len(por)])
+        ruta = tuple(c for c in r[len(por):len(por)+len(niveles)] if c)
+        nodo = _nodo(clave, ruta)
+        nodo["monto_explicito"] = (nodo["monto_explicito"] or 0.0) + float(r.monto)
+        nodo["denominacion"] = nodo["denominacion"] or ("" if pd.isna(r.denominacion) else str(r.denominacion))
+        for i in range(len(ruta)):
+            _nodo(clave, ruta[:i])["hijos"].add(ruta[i])
+
+    # de hojas a raíz: total y top-k hijos de cada nodo
+    for (clave, ruta) in sorted(nodos, key=lambda k: len(k[1]), reverse=True):
+        nodo = nodos[(clave, ruta)]
+        codigos = sorted(nodo.pop("hijos"))
+        montos = np.array([nodos[(clave, ruta + (c,))]["monto"] for c in codigos], dtype=float)
+        explicito = nodo.pop("monto_explicito")
+        nodo["monto"] = explicito if explicito is not None else float(montos.sum())
+        sel = _top_k(montos, top)
+        nodo["top_hijos"] = [codigos[i] for i in sel]
+        nodo["n_hijos"] = len(codigos)
+        nodo["monto_resto"] = float(montos.sum() - montos[sel].sum())
+
+    return {"por": por, "niveles": niveles, "top": top, "nodos": nodos}
+
+def expandir_nodo(jerarquia, clave, ruta=()):
+    """Hijos (top-k + 'otros') de un nodo. clave: valores de `por` (ej. (2023, "sec", "")); ruta: códigos desde el subtítulo."""
+    por, niveles, nodos = jerarquia["por"], jerarquia["niveles"], jerarquia["nodos"]
+    clave = tuple(str(v).lower() if isinstance(v, str) else v for v in clave)
+    ruta = tuple(str(c) for c in ruta)
+    cols = por + ["nivel","codigo","ruta","denominacion","monto","n_hijos"]
+    nodo = nodos.get((clave, ruta))
+    if nodo is None or len(ruta) >= len(niveles):
+        return pd.DataFrame(columns=cols)
+
+    nivel = niveles[len(ruta)]
+    filas = []
+    for c in nodo["top_hijos"]:
+        hijo = nodos[(clave, ruta + (c,))]
+        filas.append([*clave, nivel, c, ".".join(ruta + (c,)), hijo["denominacion"], hijo["monto"], hijo["n_hijos"]])
+    resto = nodo["n_hijos"] - len(nodo["top_hijos"])
+    if resto > 0:
+        filas.append([*clave, nivel, "otros", ".".join(ruta), f"otros ({resto})", nodo["monto_resto"], resto])
+    return pd.DataFrame(filas, columns=cols)
 
 def _apply_scope(df, scope):
     out = df.copy()
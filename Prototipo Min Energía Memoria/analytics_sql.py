@@ -0,0 +1,170 @@
+# analytics_sql.py
+"""
+Backend alternativo de analytics sobre SQLite en disco (ANALYTICS_BACKEND=sqlite).
+Misma interfaz que analytics.py pero recibe la ruta de la base en vez del DataFrame:
+los filtros de scope se empujan al WHERE (índice por anio) y solo se traen a pandas
+los agregados. La de-acumulación reutiliza los helpers de analytics para dar el mismo resultado.
+"""
+import os
+import uuid
+import sqlite3
+import pandas as pd
+
+from etl_normalize import huella_csvs  # re-exportada: main y loader la usan desde aquí
+
+from analytics import MES_NUM, NIVELES, _periodos, _tabla_flujos, _serie_desde_agg, _con_variacion_anual, _con_variaciones_periodo, _jerarquia_desde_filas
+
+ANALYTICS_DB = os.getenv("ANALYTICS_DB", "canonico.sqlite")
+TABLA = "canonico"
+
+def _lower(x):
+    # mismo lower que pandas (SQLite solo baja ASCII)
+    return x.lower() if isinstance(x, str) else None
+
+def _conectar(db_path):
+    con = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    con.create_function("py_lower", 1, _lower, deterministic=True)
+    return con
+
+def huella_sqlite(db_path=ANALYTICS_DB):
+    """Huella con la que se publicó la base (None si no existe o es de una versión anterior)."""
+    if not os.path.exists(db_path):
+        return None
+    try:
+        con = _conectar(db_path)
+        try:
+            fila = con.execute("SELECT valor FROM _meta WHERE clave = 'huella'").fetchone()
+        finally:
+            con.close()
+    except sqlite3.Error:
+        return None
+    return fila[0] if fila else None
+
+def vigente(db_path=ANALYTICS_DB, data_dir="data"):
+    """True si la base existe y se publicó con los CSV actuales."""
+    return huella_sqlite(db_path) == huella_csvs(data_dir)
+
+def publicar_sqlite(df, db_path=ANALYTICS_DB, huella=None):
+    """
+    Vuelca el DF canónico a SQLite (índice anio → mes_cierre, equivalente a particionar por año).
+    huella: ver `huella_csvs`; permite detectar después que los CSV cambiaron.
+    """
+    # temporal único: varios workers pueden publicar a la vez (el último os.replace gana, todos iguales)
+    tmp = f"{db_path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        con = sqlite3.connect(tmp)
+        try:
+            df.to_sql(TABLA, con, index=False)
+            con.execute(f"CREATE INDEX ix_{TABLA}_anio ON {TABLA}(anio, mes_cierre, capitulo, programa)")
+            # dtypes originales para devolver los mismos tipos que el backend pandas
+            pd.DataFrame({"columna": df.columns, "dtype": [str(t) for t in df.dtypes]}).to_sql("_dtypes", con, index=False)
+            pd.DataFrame({"clave": ["huella"], "valor": [huella or ""]}).to_sql("_meta", con, index=False)
+            con.commit()
+        finally:
+            con.close()
+        os.replace(tmp, db_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    print(f"💾 DF canónico publicado en SQLite: {db_path} ({len(df)} filas)")
+
+def _where(scope, extra=()):
+    """Traduce el scope (misma semántica que analytics._apply_scope) a WHERE + parámetros."""
+    conds, params = list(extra), []
+    if scope.get("anio"):
+        conds.append(f"anio IN ({','.join('?' * len(scope['anio']))})")
+        params += list(scope["anio"])
+    if scope.get("capitulo"):
+        conds.append(f"py_lower(capitulo) IN ({','.join('?' * len(scope['capitulo']))})")
+        params += [x.lower() for x in scope["capitulo"]]
+        if not scope.get("programa"):
+            conds.append("(programa = '' OR programa IS NULL)")
+    if scope.get("programa"):
+        conds.append(f"py_lower(programa) IN ({','.join('?' * len(scope['programa']))})")
+        params += [x.lower() for x in scope["programa"]]
+    if not scope.get("incluir_ingresos", False):
+        conds.append("(tipo_mov IS NULL OR tipo_mov != 'INGRESO')")
+    if scope.get("subtitulo_range"):
+        conds.append("subtitulo BETWEEN ? AND ?")
+        params += list(scope["subtitulo_range"])
+    return ("WHERE " + " AND ".join(conds)) if conds else "", params
+
+def _query(db_path, sql, params):
+    con = _conectar(db_path)
+    try:
+        out = pd.read_sql_query(sql, con, params=params)
+        tipos = dict(con.execute("SELECT columna, dtype FROM _dtypes").fetchall())
+    finally:
+        con.close()
+    for c in out.columns:
+        # columnas del canónico → dtype original; agregados (SUM) → float64 aunque no haya filas
+        out[c] = out[c].astype(tipos[c] if c in tipos and c != "monto" else "float64")
+    return out
+
+def _no_nulos(cols):
+    return [f"{c} IS NOT NULL" for c in cols]
+
+def totales_anuales(db_path, scope):
+    where, params = _where(scope, ["mes_cierre = 'diciembre'"])
+    sql = f"SELECT anio, SUM(monto) AS total_anual FROM {TABLA} {where} GROUP BY anio ORDER BY anio"
+    res = _query(db_path, sql, params)
+    if res.empty:
+        # fallback: suma todo el año si no hay cierre explícito
+        where, params = _where(scope)
+        res = _query(db_path, f"SELECT anio, SUM(monto) AS total_anual FROM {TABLA} {where} GROUP BY anio ORDER BY anio", params)
+    return _con_variacion_anual(res[res["anio"].notna()].reset_index(drop=True), "total_anual")
+
+def flujos_por_periodo(db_path, scope, por=("anio",), periodo="trimestral", arrastrar=None):
+    por = list(por)
+    periodos, _ = _periodos(periodo)
+    meses = list(periodos.keys())
+    where, params = _where(scope, _no_nulos(por) + [f"mes_cierre IN ({','.join('?' * len(meses))})"])
+    cols = ", ".join(por + ["mes_cierre"])
+    sql = f"SELECT {cols}, SUM(monto) AS monto FROM {TABLA} {where} GROUP BY {cols}"
+    acc = _query(db_path, sql, meses + params).set_index(por + ["mes_cierre"])["monto"]
+    return _tabla_flujos(acc, por, periodo, arrastrar)
+
+def totales_trimestrales(db_path, scope):
+    return _con_variaciones_periodo(flujos_por_periodo(db_path, scope, por=["anio"], periodo="trimestral"), ["anio"], "trimestral")
+
+def serie_mensual(db_path, scope):
+    meses = list(MES_NUM.keys())
+    where, params = _where(scope, _no_nulos(["anio"]) + [f"mes_cierre IN ({','.join('?' * len(meses))})"])
+    sql = f"SELECT anio, mes_cierre, SUM(monto) AS monto FROM {TABLA} {where} GROUP BY anio, mes_cierre"
+    agg = _query(db_path, sql, meses + params)
+    agg.insert(1, "mes_num", agg["mes_cierre"].map(MES_NUM).astype("int64"))
+    return _serie_desde_agg(agg.sort_values(["anio","mes_num"]).reset_index(drop=True))
+
+def desglose_por_denominacion(db_path, scope, top=20, periodo="anual"):
+    extra = _no_nulos(["anio", "denominacion"])
+    if periodo in ("anual", "q4"):
+        extra.append("mes_cierre = 'diciembre'")
+    where, params = _where(scope, extra)
+    sql = f"""
+        WITH g AS (
+            SELECT anio, denominacion, SUM(monto) AS monto FROM {TABLA} {where} GROUP BY anio, denominacion
+        ), r AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY anio ORDER BY monto DESC, denominacion) AS rn FROM g
+        )
+        SELECT anio, denominacion, monto FROM r WHERE rn <= ? ORDER BY anio, rn"""
+    return _query(db_path, sql, params + [top])
+
+def construir_jerarquia(db_path, scope=None, por=("anio","capitulo","programa"), niveles=NIVELES, top=20):
+    """
+    Igual que analytics.construir_jerarquia, pero el GROUP BY (por + niveles) al cierre de diciembre
+    corre en SQLite: a pandas solo llega una fila por combinación de códigos, con la primera
+    denominación no nula en el orden de la fuente (rowid).
+    """
+    por, niveles = list(por), list(niveles)
+    where, params = _where(scope or {}, ["mes_cierre = 'diciembre'"])
+    cols = ", ".join(por + niveles)
+    sql = f"""
+        WITH g AS (
+            SELECT {cols}, SUM(monto) AS monto,
+                   MIN(CASE WHEN denominacion IS NOT NULL THEN rowid END) AS primera
+            FROM {TABLA} {where} GROUP BY {cols}
+        )
+        SELECT g.*, c.denominacion FROM g LEFT JOIN {TABLA} c ON c.rowid = g.primera
+        ORDER BY g.primera IS NULL, g.primera"""
+    agg = _query(db_path, sql, params)
+    return _jerarquia_desde_filas(agg, por, niveles, top)
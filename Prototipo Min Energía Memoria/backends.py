@@ -0,0 +1,94 @@
+# backends.py
+import os
+import re
+import zlib
+import numpy as np
+
+class OpenAIBackend:
+    """Embeddings y completions vía API de OpenAI (OPENAI_BASE_URL permite apuntar a otro servidor)."""
+    nombre = "openai"
+
+    def __init__(self, api_key=None, embedding_model="text-embedding-3-small"):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"))
+        self.embedding_model = embedding_model
+
+    def embed(self, text, model=None):
+        resp = self.client.embeddings.create(model=model or self.embedding_model, input=text)
+        return resp.data[0].embedding
+
+    def complete(self, system_prompt, model):
+        completion = self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "system", "content": system_prompt}],
+        )
+        return completion.choices[0].message.content.strip()
+
+class LocalBackend:
+    """
+    Backend determinístico sin red: embeddings por n-gramas de caracteres hasheados (TF sublineal × IDF)
+    y completions con un resumidor por plantilla que devuelve la tabla ya calculada.
+    """
+    nombre = "local"
+    NGRAMAS = (3, 4, 5)
+
+    def __init__(self, dim=None, idf_file=None):
+        self.dim = int(dim or os.getenv("LOCAL_EMBEDDING_DIM", "1024"))
+        # idf_file="" → sin IDF persistido (solo TF)
+        self.idf_file = idf_file if idf_file is not None else os.getenv("LOCAL_IDF_FILE", "idf_local.npy")
+        self.idf = None
+        if self.idf_file and os.path.exists(self.idf_file):
+            idf = np.load(self.idf_file)
+            if len(idf) == self.dim:
+                self.idf = idf
+
+    def _conteos(self, text):
+        t = re.sub(r"\s+", " ", str(text).lower())
+        cubetas = []
+        for palabra in t.split(" "):
+            w = f" {palabra} "
+            for n in self.NGRAMAS:
+                cubetas.extend(zlib.crc32(w[i:i+n].encode("utf-8")) % self.dim for i in range(max(len(w) - n + 1, 0)))
+        return np.bincount(np.asarray(cubetas, dtype=np.int64), minlength=self.dim).astype(float)
+
+    def ajustar_idf(self, textos):
+        """Calcula y persiste el IDF del corpus (las consultas usan el mismo archivo)."""
+        df = np.zeros(self.dim)
+        for t in textos:
+            df += self._conteos(t) > 0
+        self.idf = np.log((1 + len(textos)) / (1 + df)) + 1.0
+        if self.idf_file:
+            np.save(self.idf_file, self.idf)
+
+    def embed(self, text, model=None):
+        v = self._conteos(text)
+        v[v > 0] = 1.0 + np.log(v[v > 0])
+        if self.idf is not None:
+            v *= self.idf
+        norma = np.linalg.norm(v)
+        return (v / norma if norma else v).tolist()
+
+    def complete(self, system_prompt, model=None):
+        tabla = re.search(r"TABLA\n(.*?)\n\s*\nPregunta:", system_prompt, flags=re.S)
+        pregunta = re.search(r"Pregunta:\n(.*?)\n\s*\nInstrucciones:", system_prompt, flags=re.S)
+        partes = ["Respuesta en modo local (sin modelo de lenguaje): cifras calculadas en Python."]
+        if pregunta:
+            partes.append(f"Pregunta: {pregunta.group(1).strip()}")
+        partes.append(tabla.group(1).strip() if tabla else system_prompt.strip())
+        return "\n\n".join(partes)
+
+def get_backend(nombre=None):
+    """
+    LLM_BACKEND: "openai" (por defecto; falla al iniciar si falta OPENAI_API_KEY) | "local"
+    | "auto" (openai si hay OPENAI_API_KEY, si no local, con advertencia).
+    """
+    nombre = (nombre or os.getenv("LLM_BACKEND", "openai")).lower()
+    if nombre == "auto":
+        nombre = "openai" if os.getenv("OPENAI_API_KEY") else "local"
+        if nombre == "local":
+            print("⚠️ LLM_BACKEND=auto sin OPENAI_API_KEY: se usa el backend LOCAL (respuestas por plantilla, sin modelo de lenguaje)")
+    if nombre == "openai":
+        return OpenAIBackend()
+    if nombre == "local":
+        return LocalBackend()
+    raise ValueError(f"LLM_BACKEND no soportado: {nombre}")
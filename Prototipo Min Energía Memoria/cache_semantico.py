@@ -0,0 +1,166 @@
+# cache_semantico.py
+"""
+Cache de respuestas por similitud de la pregunta: una pregunta nueva se responde desde el cache
+si su plan (ruta + intents + scope: años, capítulos, programas) es idéntico al de una ya respondida,
+comparte los términos que cambian el sentido (más/menos, mayor/menor, sin/con, números)
+y el coseno entre sus embeddings supera el umbral del backend.
+Las entradas se agrupan por plan: la búsqueda es un producto matriz·vector solo dentro del grupo.
+
+    python cache_semantico.py   # verifica con el backend activo: paráfrasis → hit, antónimos → miss
+"""
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+CACHE_SEMANTICO = os.getenv("CACHE_SEMANTICO", "1") == "1"
+CACHE_MAX_ENTRADAS = int(os.getenv("CACHE_MAX_ENTRADAS", "1024"))
+# umbral por backend (los embeddings por n-gramas del local puntúan más alto a frases parecidas)
+UMBRAL_POR_BACKEND = {"openai": 0.95, "local": 0.92}
+UMBRAL_DEFECTO = 0.95
+
+# palabras sin contenido: se ignoran al comparar el texto ("total de la SEC en 2023" = "total SEC 2023")
+VACIAS = {"de", "del", "la", "el", "los", "las", "en", "al", "a", "un", "una", "para", "por"}
+# palabras que invierten o acotan la pregunta: deben coincidir para reutilizar una respuesta
+CRITICAS = {
+    "mas", "menos", "mayor", "menor", "mayores", "menores", "maximo", "minimo", "max", "min",
+    "top", "primer", "primero", "primeros", "ultimo", "ultimos", "sin", "con", "no", "excepto",
+    "alto", "alta", "altos", "bajo", "baja", "bajos", "aumento", "aumentos", "disminucion", "caida",
+    "subio", "bajo", "crecio", "cayo", "positivo", "negativo",
+}
+
+def umbral_para(backend_nombre):
+    """CACHE_SIMILITUD si está definido; si no, el umbral calibrado para el backend."""
+    if os.getenv("CACHE_SIMILITUD"):
+        return float(os.getenv("CACHE_SIMILITUD"))
+    return UMBRAL_POR_BACKEND.get(backend_nombre, UMBRAL_DEFECTO)
+
+def _palabras(q):
+    q = unicodedata.normalize("NFKD", str(q).lower())
+    q = "".join(c for c in q if not unicodedata.combining(c))
+    return re.findall(r"[a-z0-9]+", q)
+
+def _normalizar_texto(q):
+    return " ".join(p for p in _palabras(q) if p not in VACIAS)
+
+def _criticas(q):
+    return tuple(sorted({p for p in _palabras(q) if p in CRITICAS or p.isdigit()}))
+
+class CacheSemantico:
+    def __init__(self, umbral=UMBRAL_DEFECTO, max_entradas=CACHE_MAX_ENTRADAS):
+        self.umbral = umbral
+        self.max_entradas = max_entradas
+        self._planes = OrderedDict()  # (plan, críticas) → {"vecs": (n, d), "respuestas": [...], "textos": {q: i}} (LRU)
+        self._n = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "hits_exactos": 0, "misses": 0, "invalidaciones": 0}
+
+    def buscar_exacta(self, clave, pregunta):
+        """Misma pregunta normalizada con el mismo plan (no requiere embedding)."""
+        grupo = (clave, _criticas(pregunta))
+        with self._lock:
+            plan = self._planes.get(grupo)
+            i = plan["textos"].get(_normalizar_texto(pregunta)) if plan else None
+            if i is None:
+                return None
+            self._planes.move_to_end(grupo)
+            self.stats["hits"] += 1
+            self.stats["hits_exactos"] += 1
+            return plan["respuestas"][i]
+
+    def buscar(self, clave, pregunta, embedding):
+        """Respuesta cuyo embedding tenga coseno >= umbral dentro del mismo grupo, o None (cuenta miss)."""
+        grupo = (clave, _criticas(pregunta))
+        q = self._unitario(embedding)
+        with self._lock:
+            plan = self._planes.get(grupo)
+            if plan is not None and q is not None and plan["vecs"].shape[1] == len(q):
+                sims = plan["vecs"] @ q
+                i = int(np.argmax(sims))
+                if sims[i] >= self.umbral:
+                    self._planes.move_to_end(grupo)
+                    self.stats["hits"] += 1
+                    return plan["respuestas"][i]
+            self.stats["misses"] += 1
+            return None
+
+    def guardar(self, clave, pregunta, embedding, respuesta):
+        grupo = (clave, _criticas(pregunta))
+        q = self._unitario(embedding)
+        if q is None:
+            return
+        with self._lock:
+            plan = self._planes.get(grupo)
+            if plan is None:
+                plan = self._planes[grupo] = {"vecs": np.empty((0, len(q))), "respuestas": [], "textos": {}}
+            elif plan["vecs"].shape[1] != len(q) or len(plan["respuestas"]) >= self.max_entradas:
+                return  # dimensión distinta (cambió el backend) o plan lleno
+            plan["textos"][_normalizar_texto(pregunta)] = len(plan["respuestas"])
+            plan["vecs"] = np.vstack([plan["vecs"], q])
+            plan["respuestas"].append(respuesta)
+            self._planes.move_to_end(grupo)
+            self._n += 1
+            while self._n > self.max_entradas and len(self._planes) > 1:
+                _, viejo = self._planes.popitem(last=False)  # plan menos usado
+                self._n -= len(viejo["respuestas"])
+
+    def invalidar(self):
+        """Vacía el cache (recarga de datos: las respuestas pueden haber cambiado)."""
+        with self._lock:
+            self._planes.clear()
+            self._n = 0
+            self.stats["invalidaciones"] += 1
+
+    def resumen(self):
+        with self._lock:
+            consultas = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / consultas if consultas else 0.0,
+                "entradas": self._n,
+                "planes": len(self._planes),
+                "umbral": self.umbral,
+            }
+
+    @staticmethod
+    def _unitario(embedding):
+        v = np.asarray(embedding, dtype=float)
+        norma = np.linalg.norm(v)
+        return v / norma if v.ndim == 1 and norma else None
+
+# pares (ya respondida, nueva) con el mismo plan: las paráfrasis deben reutilizarse, los antónimos no
+PARES_HIT = [
+    ("Total ejecutado SEC 2023", "total ejecutado de la SEC en 2023"),
+    ("Ejecución total anual de la SEC 2023", "Ejecución anual total SEC 2023"),
+]
+PARES_MISS = [
+    ("¿Qué programas de la SEC tuvieron más ejecución en 2023?", "¿Qué programas de la SEC tuvieron menos ejecución en 2023?"),
+    ("mayor gasto total SEC 2023", "menor gasto total SEC 2023"),
+    ("Total SEC 2023", "Total SEC 2023 sin ingresos"),
+    ("Top 5 denominaciones SEC 2023", "Top 10 denominaciones SEC 2023"),
+]
+
+def verificar(backend):
+    """True si con `backend` las paráfrasis dan hit y los antónimos miss."""
+    ok = True
+    for (ya, nueva), esperado in [(p, True) for p in PARES_HIT] + [(p, False) for p in PARES_MISS]:
+        cache = CacheSemantico(umbral=umbral_para(backend.nombre))
+        cache.guardar("plan", ya, backend.embed(ya), "respuesta")
+        hit = cache.buscar_exacta("plan", nueva) is not None
+        if not hit:
+            hit = cache.buscar("plan", nueva, backend.embed(nueva)) is not None
+        ok &= hit == esperado
+        print(f"{'✅' if hit == esperado else '❌'} {'hit ' if hit else 'miss'} (esperado {'hit' if esperado else 'miss'}): {ya!r} → {nueva!r}")
+    return ok
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    from backends import get_backend
+
+    load_dotenv()
+    backend = get_backend()
+    print(f"🔌 Backend: {backend.nombre} | umbral {umbral_para(backend.nombre)}")
+    sys.exit(0 if verificar(backend) else 1)
@@ -1,7 +1,9 @@
 # etl_normalize.py
-import os, re, io, csv, unicodedata
+import os, re, io, csv, json, atexit, hashlib, threading, unicodedata
 import pandas as pd
 
+from profiling import perfilar_etl
+
 def _norm(s: str) -> str:
     if s is None: return ""
     s = unicodedata.normalize("NFKD", str(s))
@@ -117,12 +119,268 @@ def _choose_exec_col(headers, period_hint):
                 return h
     return best
 
+# ---------- Registro de esquemas (layout de headers → mapeo de columnas) ----------
+SCHEMA_REGISTRY_FILE = os.getenv("SCHEMA_REGISTRY_FILE", "schema_registry.json")
+_MAX_EJEMPLOS = 5
+# subir al cambiar COL_ALIASES, _choose_exec_col o _sniff_delim: los mapeos persistidos con otra versión se descartan
+VERSION_RESOLVEDOR = 1
+
+_registro = None  # {"version": n, "esquemas": {clave: entrada}, "delimitadores": {linea_header: delim}}
+_registro_lock = threading.Lock()
+_registro_sucio = False
+_veces_pendientes = {}  # clave → usos en el ETL aún no persistidos (se suman a los del archivo al guardar)
+_delims_consulta = {}  # delimitadores de documentos vistos solo en consultas (no se persisten)
+_mapeos_consulta = {}  # ídem para mapeos
+
+def _leer_registro_disco():
+    """Registro persistido; vacío si no existe, es ilegible o es de otra versión del resolvedor."""
+    vacio = {"version": VERSION_RESOLVEDOR, "esquemas": {}, "delimitadores": {}}
+    if not os.path.exists(SCHEMA_REGISTRY_FILE):
+        return vacio
+    try:
+        with open(SCHEMA_REGISTRY_FILE, encoding="utf-8") as f:
+            reg = json.load(f)
+    except Exception as e:
+        print(f"⚠️ Registro de esquemas ilegible ({SCHEMA_REGISTRY_FILE}), se reconstruye: {e}")
+        return vacio
+    if reg.get("version") != VERSION_RESOLVEDOR:
+        print(f"⚠️ Registro de esquemas de otra versión del resolvedor ({reg.get('version')}), se reconstruye")
+        return vacio
+    return {**vacio, **reg}
+
+def _cargar_registro():
+    global _registro
+    if _registro is None:
+        _registro = _leer_registro_disco()
+    return _registro
+
+def _fusionar(disco, local):
+    """Suma al registro en disco lo que agregó este proceso (otros workers pueden haber guardado antes)."""
+    for linea, delim in local["delimitadores"].items():
+        disco["delimitadores"].setdefault(linea, delim)
+    for clave, e in local["esquemas"].items():
+        d = disco["esquemas"].get(clave)
+        if d is None:
+            disco["esquemas"][clave] = e
+            continue
+        # el mapeo en disco manda (puede haberse corregido a mano)
+        d["veces"] += _veces_pendientes.get(clave, 0)
+        for ej in e["ejemplos"]:
+            if ej not in d["ejemplos"] and len(d["ejemplos"]) < _MAX_EJEMPLOS:
+                d["ejemplos"].append(ej)
+    return disco
+
+def guardar_registro_esquemas():
+    """Persiste el registro si hubo layouts nuevos (fusiona con el archivo actual, escritura atómica)."""
+    global _registro, _registro_sucio
+    with _registro_lock:
+        if not _registro_sucio or _registro is None:
+            return
+        # temporal por proceso: con varios workers normalizando a la vez no se pisan entre sí
+        tmp = f"{SCHEMA_REGISTRY_FILE}.{os.getpid()}.tmp"
+        try:
+            fusionado = _fusionar(_leer_registro_disco(), _registro)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(fusionado, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, SCHEMA_REGISTRY_FILE)
+            _registro = fusionado
+            _veces_pendientes.clear()
+            _registro_sucio = False
+        except OSError as e:
+            # no es crítico: el ETL sigue y se reintenta en el próximo guardado
+            print(f"⚠️ No se pudo guardar el registro de esquemas ({SCHEMA_REGISTRY_FILE}): {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+# por si el proceso termina con layouts del ETL sin guardar
+atexit.register(guardar_registro_esquemas)
+
+def sniff_delim_registrado(text: str, registrar=True) -> str:
+    """
+    Delimitador por línea de encabezado ya vista; si es nueva, se detecta y se registra.
+    registrar=False (consultas): solo lee el registro; lo nuevo queda en memoria de este proceso.
+    """
+    global _registro_sucio
+    linea = text.split("\n", 1)[0].strip()
+    with _registro_lock:
+        reg = _cargar_registro()
+        delim = reg["delimitadores"].get(linea) or _delims_consulta.get(linea)
+        if delim is None:
+            delim = _sniff_delim(text[:5000])
+            if registrar:
+                reg["delimitadores"][linea] = delim
+                _registro_sucio = True
+            else:
+                _delims_consulta[linea] = delim
+    return delim
+
+def _clave_esquema(delim, headers, period_hint):
+    ph = period_hint or {}
+    return json.dumps([delim, [_norm(h).lower() for h in headers],
+                       [ph.get("period_type"), ph.get("quarter"), ph.get("mes_cierre")]], ensure_ascii=False)
+
+def _resolver_mapeo(headers, period_hint):
+    """Mapeo canónico → índice de columna (None si no existe)."""
+    pos = {h: i for i, h in enumerate(headers)}
+    mapeo = {k: _find_col(headers, aliases) for k, aliases in COL_ALIASES.items()}
+    mapeo["exec"] = _choose_exec_col(headers, period_hint)
+    return {k: pos.get(h) for k, h in mapeo.items()}
+
+def mapeo_columnas(delim, headers, period_hint, archivo=None, registrar=True):
+    """
+    Resuelve (o reutiliza) el mapeo de columnas para un layout (delimitador, headers normalizados, período).
+    Devuelve {canon: nombre_de_header | None}. El registro persistido puede editarse a mano para corregir mapeos.
+    registrar=False (consultas): solo lee el registro, sin contar usos ni marcarlo para guardar.
+    """
+    global _registro_sucio
+    headers = list(headers or [])
+    clave = _clave_esquema(delim, headers, period_hint)
+    with _registro_lock:
+        reg = _cargar_registro()
+        entrada = reg["esquemas"].get(clave)
+        if not registrar:
+            if entrada is None:
+                entrada = _mapeos_consulta.get(clave)
+            if entrada is None:
+                entrada = _mapeos_consulta[clave] = {"mapeo": _resolver_mapeo(headers, period_hint)}
+            idx = dict(entrada["mapeo"])
+            return {k: (headers[i] if i is not None and i < len(headers) else None) for k, i in idx.items()}
+        if entrada is None:
+            entrada = {"mapeo": _resolver_mapeo(headers, period_hint), "headers": headers, "veces": 0, "ejemplos": []}
+            reg["esquemas"][clave] = entrada
+        entrada["veces"] += 1
+        _veces_pendientes[clave] = _veces_pendientes.get(clave, 0) + 1
+        if archivo and archivo not in entrada["ejemplos"] and len(entrada["ejemplos"]) < _MAX_EJEMPLOS:
+            entrada["ejemplos"].append(archivo)
+        _registro_sucio = True
+        idx = dict(entrada["mapeo"])
+    return {k: (headers[i] if i is not None and i < len(headers) else None) for k, i in idx.items()}
+
+def listar_esquemas():
+    """Layouts vistos y cómo se resolvieron (para auditar mapeos)."""
+    with _registro_lock:
+        reg = _cargar_registro()
+        out = []
+        for clave, e in reg["esquemas"].items():
+            delim, _, periodo = json.loads(clave)
+            hs = e["headers"]
+            out.append({
+                "delimitador": delim,
+                "periodo": periodo,
+                "veces": e["veces"],
+                "ejemplos": list(e["ejemplos"]),
+                "mapeo": {k: (hs[i] if i is not None and i < len(hs) else None) for k, i in e["mapeo"].items()},
+            })
+    return sorted(out, key=lambda r: -r["veces"])
+
 def _to_float(x):
     if x is None or (isinstance(x, float) and pd.isna(x)): return 0.0
     s = str(x).replace("\u00a0","").replace(".", "").replace(",", ".").strip()
     try: return float(s)
     except: return 0.0
 
+def _normalize_file(path, default_partida):
+    """Filas canónicas de un CSV."""
+    rows = []
+    name = os.path.basename(path)
+
+    # año por ruta o nombre
+    anio = None
+    parts = re.findall(r"(20[0-9]{2})", path)
+    if parts: anio = parts[-1]
+
+    # leer contenido
+    with open(path, encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    delim = sniff_delim_registrado(text)
+    reader = csv.DictReader(io.StringIO(text), delimiter=delim)
+    headers = reader.fieldnames or []
+
+    # período: intenta por archivo/ruta, si no, por headers
+    period_hint = _infer_period_from_filename_and_path(name, path)
+    if not period_hint or not period_hint.get("mes_cierre"):
+        h_hint = _infer_period_from_headers(headers)
+        if h_hint: period_hint = h_hint
+
+    # columna de ejecución + columnas canon (resueltas una vez por layout)
+    mapeo = mapeo_columnas(delim, headers, period_hint, archivo=name)
+    exec_col = mapeo["exec"]
+    col_subt = mapeo["subtitulo"]
+    col_item = mapeo["item"]
+    col_asig = mapeo["asignacion"]
+    col_subasig = mapeo["sub_asignacion"]
+    col_deno = mapeo["denominacion"]
+    col_cap = mapeo["capitulo"]
+    col_prog = mapeo["programa"]
+    col_part = mapeo["partida"]
+
+    # --- detectar tipo de archivo por nombre ---
+    nlow = _norm(name).lower()
+    is_cap = "ejecucion_capitulo_" in nlow
+    is_prog = "ejecucion_programa_" in nlow
+
+    infer_cap = None
+    infer_prog = None
+
+    # si es archivo de CAPÍTULO -> inferimos capitulo
+    if is_cap:
+        for tag in ["subsecretaria", "cne", "cchen", "sec"]:
+            if f"capitulo_{tag}" in nlow or f"capitulo {tag}" in nlow or f"_{tag}_" in nlow:
+                infer_cap = tag
+                break
+
+    # si es archivo de PROGRAMA -> inferimos programa, NO capitulo
+    if is_prog:
+        m = re.search(r"ejecucion_programa_([a-z0-9_]+)", nlow)
+        if m:
+            infer_prog = m.group(1)
+
+    for row in reader:
+        monto = _to_float(row.get(exec_col)) if exec_col else 0.0
+
+        # subtítulo -> clasifica ingreso/gasto
+        subt = row.get(col_subt) if col_subt else None
+        try:
+            subt_num = int(str(subt).strip()) if subt is not None and str(subt).strip().isdigit() else None
+        except:
+            subt_num = None
+        tipo_mov = None
+        if subt_num is not None:
+            if 5 <= subt_num <= 15:
+                tipo_mov = "INGRESO"
+            elif 21 <= subt_num <= 34:
+                tipo_mov = "GASTO"
+
+        rows.append({
+            "anio": int(anio) if anio else None,
+            "period_type": period_hint.get("period_type"),
+            "quarter": period_hint.get("quarter"),
+            "mes_cierre": period_hint.get("mes_cierre"),
+            "partida": row.get(col_part) or default_partida,
+            "capitulo": row.get(col_cap) or infer_cap,
+            "programa": row.get(col_prog) or infer_prog,
+            "subtitulo": subt_num,
+            "item": row.get(col_item),
+            "asignacion": row.get(col_asig),
+            "sub_asignacion": row.get(col_subasig),
+            "denominacion": row.get(col_deno),
+            "tipo_mov": tipo_mov,
+            "monto": monto,
+            "fuente": name,
+        })
+    return rows
+
+def huella_csvs(data_dir="data"):
+    """Huella de los CSV de entrada (ruta, tamaño, mtime): cambia si se agrega, quita o modifica un archivo."""
+    h = hashlib.sha1()
+    for root, dirs, filenames in os.walk(data_dir):
+        dirs.sort()
+        for fn in sorted(filenames):
+            if fn.lower().endswith(".csv"):
+                st = os.stat(os.path.join(root, fn))
+                h.update(f"{os.path.relpath(os.path.join(root, fn), data_dir)}|{st.st_size}|{st.st_mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
 def normalize_csvs(input_paths_or_dir, default_partida="24"):
     """
     Lee uno o varios CSV (ruta o carpeta) y devuelve DataFrame canónico (todas las denominaciones).
@@ -143,99 +401,21 @@ def normalize_csvs(input_paths_or_dir, default_partida="24"):
 
     rows = []
     for path in files:
-        name = os.path.basename(path)
-
-        # año por ruta o nombre
-        anio = None
-        parts = re.findall(r"(20[0-9]{2})", path)
-        if parts: anio = parts[-1]
-
-        # leer contenido
-        with open(path, encoding="utf-8", errors="replace") as f:
-            text = f.read()
-        sample = text[:5000]
-        delim = _sniff_delim(sample)
-        reader = csv.DictReader(io.StringIO(text), delimiter=delim)
-        headers = reader.fieldnames or []
-
-        # período: intenta por archivo/ruta, si no, por headers
-        period_hint = _infer_period_from_filename_and_path(name, path)
-        if not period_hint or not period_hint.get("mes_cierre"):
-            h_hint = _infer_period_from_headers(headers)
-            if h_hint: period_hint = h_hint
-
-        # columna de ejecución (flexible)
-        exec_col = _choose_exec_col(headers, period_hint)
-
-        # columnas canon
-        col_subt = _find_col(headers, COL_ALIASES["subtitulo"])
-        col_item = _find_col(headers, COL_ALIASES["item"])
-        col_asig = _find_col(headers, COL_ALIASES["asignacion"])
-        col_subasig = _find_col(headers, COL_ALIASES["sub_asignacion"])
-        col_deno = _find_col(headers, COL_ALIASES["denominacion"])
-        col_cap = _find_col(headers, COL_ALIASES["capitulo"])
-        col_prog = _find_col(headers, COL_ALIASES["programa"])
-        col_part = _find_col(headers, COL_ALIASES["partida"])
-
-        # --- detectar tipo de archivo por nombre ---
-        nlow = _norm(name).lower()
-        is_cap = "ejecucion_capitulo_" in nlow
-        is_prog = "ejecucion_programa_" in nlow
-
-        infer_cap = None
-        infer_prog = None
-
-        # si es archivo de CAPÍTULO -> inferimos capitulo
-        if is_cap:
-            for tag in ["subsecretaria", "cne", "cchen", "sec"]:
-                if f"capitulo_{tag}" in nlow or f"capitulo {tag}" in nlow or f"_{tag}_" in nlow:
-                    infer_cap = tag
-                    break
-
-        # si es archivo de PROGRAMA -> inferimos programa, NO capitulo
-        if is_prog:
-            m = re.search(r"ejecucion_programa_([a-z0-9_]+)", nlow)
-            if m:
-                infer_prog = m.group(1)
-
-        for row in reader:
-            monto = _to_float(row.get(exec_col)) if exec_col else 0.0
-
-            # subtítulo -> clasifica ingreso/gasto
-            subt = row.get(col_subt) if col_subt else None
-            try:
-                subt_num = int(str(subt).strip()) if subt is not None and str(subt).strip().isdigit() else None
-            except:
-                subt_num = None
-            tipo_mov = None
-            if subt_num is not None:
-                if 5 <= subt_num <= 15:
-                    tipo_mov = "INGRESO"
-                elif 21 <= subt_num <= 34:
-                    tipo_mov = "GASTO"
-
-            rows.append({
-                "anio": int(anio) if anio else None,
-                "period_type": period_hint.get("period_type"),
-                "quarter": period_hint.get("quarter"),
-                "mes_cierre": period_hint.get("mes_cierre"),
-                "partida": row.get(col_part) or default_partida,
-                "capitulo": row.get(col_cap) or infer_cap,
-                "programa": row.get(col_prog) or infer_prog,
-                "subtitulo": subt_num,
-                "item": row.get(col_item),
-                "asignacion": row.get(col_asig),
-                "sub_asignacion": row.get(col_subasig),
-                "denominacion": row.get(col_deno),
-                "tipo_mov": tipo_mov,
-                "monto": monto,
-                "fuente": name,
-            })
+        with perfilar_etl(path):
+            rows.extend(_normalize_file(path, default_partida))
 
     df = pd.DataFrame(rows)
+    guardar_registro_esquemas()
 
     # limpia nulos de strings
     for c in ["partida","capitulo","programa","item","asignacion","sub_asignacion","denominacion","mes_cierre","period_type","fuente"]:
         if c in df.columns:
             df[c] = df[c].astype("string").fillna("")
     return df
+
+if __name__ == "__main__":
+    # Auditoría: layouts de CSV vistos y su mapeo resuelto
+    for e in listar_esquemas():
+        print(f"[{e['veces']}x] delim='{e['delimitador']}' periodo={e['periodo']} ejemplos={e['ejemplos']}")
+        for k, h in e["mapeo"].items():
+            print(f"    {k:15s} ← {h}")
@@ -0,0 +1,97 @@
+# fake_openai.py
+"""
+Servidor local que imita /v1/chat/completions y /v1/embeddings de OpenAI con latencia configurable,
+para pruebas de carga sin red ni costo. Uso:
+
+    python fake_openai.py --port 8100 --chat-ms 800 --embed-ms 50
+    OPENAI_BASE_URL=http://127.0.0.1:8100/v1 OPENAI_API_KEY=fake LLM_BACKEND=openai uvicorn main:app
+"""
+import os
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+import uvicorn
+
+from backends import LocalBackend
+
+CONFIG = {
+    "chat_ms": float(os.getenv("FAKE_CHAT_LATENCY_MS", "800")),
+    "embed_ms": float(os.getenv("FAKE_EMBED_LATENCY_MS", "50")),
+    "jitter": float(os.getenv("FAKE_JITTER", "0.2")),  # ± fracción de la latencia
+    "error_rate": float(os.getenv("FAKE_ERROR_RATE", "0")),  # fracción de respuestas 500
+}
+
+app = FastAPI()
+_local = LocalBackend(dim=1536, idf_file="")  # mismas dimensiones que text-embedding-3-small
+stats = {"chat": 0, "embeddings": 0, "errores": 0}
+
+async def _latencia(ms):
+    j = CONFIG["jitter"]
+    await asyncio.sleep(max(ms * (1 + random.uniform(-j, j)), 0) / 1000)
+
+def _error_simulado():
+    if random.random() < CONFIG["error_rate"]:
+        stats["errores"] += 1
+        return JSONResponse({"error": {"message": "error simulado", "type": "server_error"}}, status_code=500)
+    return None
+
+def _tokens(texto):
+    return len(texto) // 4 + 1
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["chat"] += 1
+    await _latencia(CONFIG["chat_ms"])
+    err = _error_simulado()
+    if err is not None:
+        return err
+    prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+    contenido = _local.complete(prompt)
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": contenido}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": _tokens(prompt), "completion_tokens": _tokens(contenido),
+                  "total_tokens": _tokens(prompt) + _tokens(contenido)},
+    }
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    stats["embeddings"] += 1
+    await _latencia(CONFIG["embed_ms"])
+    err = _error_simulado()
+    if err is not None:
+        return err
+    entradas = body.get("input", "")
+    entradas = entradas if isinstance(entradas, list) else [entradas]
+    n = sum(_tokens(str(t)) for t in entradas)
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": _local.embed(str(t))} for i, t in enumerate(entradas)],
+        "model": body.get("model", "fake"),
+        "usage": {"prompt_tokens": n, "total_tokens": n},
+    }
+
+@app.get("/stats")
+async def get_stats():
+    return {**stats, **CONFIG}
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Servidor OpenAI falso para pruebas de carga")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8100)
+    p.add_argument("--chat-ms", type=float, default=CONFIG["chat_ms"])
+    p.add_argument("--embed-ms", type=float, default=CONFIG["embed_ms"])
+    p.add_argument("--jitter", type=float, default=CONFIG["jitter"])
+    p.add_argument("--error-rate", type=float, default=CONFIG["error_rate"])
+    args = p.parse_args()
+    CONFIG.update(chat_ms=args.chat_ms, embed_ms=args.embed_ms, jitter=args.jitter, error_rate=args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
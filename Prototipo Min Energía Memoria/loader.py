@@ -1,23 +1,44 @@
 import os
+import json
 import pickle
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.ipc as ipc
 from preprocess_embeddings import ingest_documents, get_embedding
+from etl_normalize import huella_csvs
 
 EMBEDDINGS_FILE = "embeddings.pkl"
 
-def load_embeddings(client, force_recalculate=False):
+def _embeddings_file(backend):
+    # embeddings de backends distintos no son comparables → un archivo por backend
+    nombre = getattr(backend, "nombre", "openai")
+    return EMBEDDINGS_FILE if nombre == "openai" else f"embeddings_{nombre}.pkl"
+
+# Datos compartidos entre workers (Arrow IPC + .npy, ambos mapeables en memoria)
+SHARED_DIR = os.getenv("SHARED_DATA_DIR", "shared")
+SHARED_CANONICO = "df_canonico.arrow"
+SHARED_DOCUMENTOS = "documentos.arrow"
+SHARED_EMBEDDINGS = "embeddings.npy"
+SHARED_MANIFEST = "manifest.json"
+
+def load_embeddings(backend, force_recalculate=False):
+    embeddings_file = _embeddings_file(backend)
     # Si existe archivo y no forzamos recalcular → cargar directo
-    if os.path.exists(EMBEDDINGS_FILE) and not force_recalculate:
-        print(f"📂 Cargando embeddings desde {EMBEDDINGS_FILE}...")
-        with open(EMBEDDINGS_FILE, "rb") as f:
+    if os.path.exists(embeddings_file) and not force_recalculate:
+        print(f"📂 Cargando embeddings desde {embeddings_file}...")
+        with open(embeddings_file, "rb") as f:
             documentos = pickle.load(f)
         print(f"✅ Embeddings cargados: {len(documentos)} documentos.")
         return documentos
 
     # Si no existe o forzamos recalcular → generar
     documentos = ingest_documents("data")
+    if hasattr(backend, "ajustar_idf"):
+        backend.ajustar_idf([doc["contenido"][:3000] for doc in documentos])
     for i, doc in enumerate(documentos, start=1):
         try:
-            doc["embedding"] = get_embedding(client, doc["contenido"][:3000])
+            doc["embedding"] = get_embedding(backend, doc["contenido"][:3000])
             if i % 50 == 0:
                 print(f"🔹 Progreso: {i}/{len(documentos)} documentos procesados")
         except Exception as e:
@@ -25,8 +46,156 @@ def load_embeddings(client, force_recalculate=False):
             doc["embedding"] = []
 
     # Guardar en disco
-    with open(EMBEDDINGS_FILE, "wb") as f:
+    with open(embeddings_file, "wb") as f:
         pickle.dump(documentos, f)
-    print(f"💾 Embeddings guardados en {EMBEDDINGS_FILE}")
+    print(f"💾 Embeddings guardados en {embeddings_file}")
 
     return documentos
+
+# ---------- Publicación / adjunción de datos compartidos ----------
+def _write_atomic(path, write_fn):
+    tmp = path + ".tmp"
+    write_fn(tmp)
+    os.replace(tmp, path)
+
+def _write_npy(arr, path):
+    def _w(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, arr)
+    _write_atomic(path, _w)
+
+def _write_json(obj, path):
+    def _w(tmp):
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(obj, f, ensure_ascii=False, indent=2)
+    _write_atomic(path, _w)
+
+def _write_ipc(table, path):
+    def _w(tmp):
+        with pa.OSFile(tmp, "wb") as sink:
+            with ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+    _write_atomic(path, _w)
+
+def publish_shared(df, documentos, shared_dir=SHARED_DIR, backend_nombre="openai", huella=None):
+    """
+    Publica DF canónico, documentos y matriz de embeddings en `shared_dir` para que
+    cada worker de uvicorn se adjunte por mmap en vez de repetir el ETL.
+    huella: `huella_csvs` de los CSV usados; los workers no se adjuntan si los CSV cambiaron.
+    El manifest se escribe al final: si existe, el resto de archivos está completo.
+    """
+    os.makedirs(shared_dir, exist_ok=True)
+    manifest_path = os.path.join(shared_dir, SHARED_MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    if df is not None:
+        _write_ipc(pa.Table.from_pandas(df, preserve_index=False), os.path.join(shared_dir, SHARED_CANONICO))
+
+    # documentos (sin embedding) + matriz densa float32 (filas vacías si falló el embedding)
+    embs = [d.get("embedding") if d.get("embedding") is not None else [] for d in documentos]
+    dim = max((len(e) for e in embs), default=0)
+    matriz = np.zeros((len(documentos), dim), dtype=np.float32)
+    for i, e in enumerate(embs):
+        if len(e):
+            matriz[i, :len(e)] = e
+    docs_table = pa.table({
+        "nombre": [d.get("nombre") for d in documentos],
+        "ruta": [d.get("ruta") for d in documentos],
+        "contenido": [d.get("contenido") for d in documentos],
+        "año": [d.get("año") for d in documentos],
+        "institucion": [d.get("institucion") for d in documentos],
+        "tiene_embedding": [bool(len(e)) for e in embs],
+    })
+    _write_ipc(docs_table, os.path.join(shared_dir, SHARED_DOCUMENTOS))
+    _write_npy(matriz, os.path.join(shared_dir, SHARED_EMBEDDINGS))
+
+    manifest = {
+        "filas_canonico": 0 if df is None else len(df),
+        "documentos": len(documentos),
+        "dim_embedding": dim,
+        "backend": backend_nombre,
+        "huella": huella,
+    }
+    _write_json(manifest, manifest_path)
+    print(f"💾 Datos compartidos publicados en {shared_dir}: {manifest}")
+    return manifest
+
+class _DocumentoCompartido(dict):
+    """Documento cuyo `contenido` se lee bajo demanda desde la tabla Arrow mapeada."""
+    def __init__(self, contenidos, idx, **campos):
+        super().__init__(**campos)
+        self._contenidos = contenidos
+        self._idx = idx
+
+    def __missing__(self, key):
+        if key == "contenido":
+            return self._contenidos[self._idx].as_py()
+        raise KeyError(key)
+
+    # dict.get / `in` no pasan por __missing__: mismo comportamiento que un documento del pickle
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def __contains__(self, key):
+        return key == "contenido" or super().__contains__(key)
+
+def attach_shared(shared_dir=SHARED_DIR, backend_nombre="openai", data_dir="data"):
+    """
+    Se adjunta (zero-copy) a los datos publicados por `publish_shared`.
+    Devuelve (df_canonico, documentos) o (None, None) si no hay publicación completa,
+    si los embeddings son de otro backend o si los CSV de `data_dir` cambiaron desde la publicación.
+    """
+    manifest_path = os.path.join(shared_dir, SHARED_MANIFEST)
+    if not os.path.exists(manifest_path):
+        return None, None
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    if manifest.get("backend", "openai") != backend_nombre:
+        print(f"⚠️ Datos compartidos generados con backend '{manifest.get('backend')}', se ignoran")
+        return None, None
+    if manifest.get("huella") != huella_csvs(data_dir):
+        print(f"⚠️ Los CSV de {data_dir} cambiaron desde la publicación en {shared_dir} (re-ejecutar `python loader.py`); se recalcula")
+        return None, None
+
+    df = None
+    canon_path = os.path.join(shared_dir, SHARED_CANONICO)
+    if manifest.get("filas_canonico") and os.path.exists(canon_path):
+        table = ipc.open_file(pa.memory_map(canon_path, "r")).read_all()
+        # ArrowDtype envuelve los buffers mapeados sin copiarlos a memoria privada
+        df = table.to_pandas(types_mapper=pd.ArrowDtype)
+
+    docs_table = ipc.open_file(pa.memory_map(os.path.join(shared_dir, SHARED_DOCUMENTOS), "r")).read_all()
+    matriz = np.load(os.path.join(shared_dir, SHARED_EMBEDDINGS), mmap_mode="r")
+    contenidos = docs_table.column("contenido")
+    documentos = []
+    for i, (nombre, ruta, anio, inst, tiene) in enumerate(zip(
+        docs_table.column("nombre").to_pylist(),
+        docs_table.column("ruta").to_pylist(),
+        docs_table.column("año").to_pylist(),
+        docs_table.column("institucion").to_pylist(),
+        docs_table.column("tiene_embedding").to_pylist(),
+    )):
+        documentos.append(_DocumentoCompartido(
+            contenidos, i,
+            nombre=nombre, ruta=ruta, año=anio, institucion=inst,
+            embedding=matriz[i] if tiene else [],
+        ))
+    print(f"📎 Adjuntado a datos compartidos en {shared_dir}: {manifest}")
+    return df, documentos
+
+if __name__ == "__main__":
+    # Paso de carga: ETL + embeddings una sola vez, luego los workers solo se adjuntan
+    from dotenv import load_dotenv
+    from etl_normalize import normalize_csvs
+    from backends import get_backend
+
+    load_dotenv()
+    backend = get_backend()
+    documentos = load_embeddings(backend, force_recalculate=False)
+    huella = huella_csvs("data")  # antes del ETL: si un CSV cambia durante la carga, se detecta
+    df = normalize_csvs("data")
+    publish_shared(df if not df.empty else None, documentos, backend_nombre=backend.nombre, huella=huella)
+    if os.getenv("ANALYTICS_BACKEND") == "sqlite" and not df.empty:
+        from analytics_sql import publicar_sqlite
+        publicar_sqlite(df, huella=huella)
@@ -0,0 +1,133 @@
+# loadtest.py
+"""
+Prueba de carga de /ask (y endpoints JSON) con una mezcla configurable de preguntas.
+Agrupa resultados por la ruta que tomó route_and_answer (header X-Ruta). Uso:
+
+    python loadtest.py --url http://127.0.0.1:8000 --concurrencia 16 --duracion 60 \\
+        --mezcla trimestral=3,anual=3,mensual=2,desglose=1,semantico=1,drilldown=1
+"""
+import time
+import json
+import random
+import asyncio
+import argparse
+import httpx
+
+CAPITULOS = ["SEC", "CNE", "CChEN", "Subsecretaría"]
+
+# plantillas por tipo de pregunta ({anio}, {anio2}, {cap})
+PLANTILLAS = {
+    "trimestral": ["Ejecución trimestral {cap} {anio}", "Gasto por trimestre de la {cap} en {anio}", "Compara Q1 y Q4 {cap} {anio}"],
+    "anual": ["Total ejecutado {cap} {anio}", "Compara el gasto anual {cap} {anio} y {anio2}", "Ejecución total partida 24 {anio}"],
+    "mensual": ["Evolución mensual {cap} {anio}", "Gasto mes a mes de la {cap} en {anio}"],
+    "desglose": ["Desglose por denominación {cap} {anio}", "Detalle de glosas {cap} {anio}"],
+    "semantico": ["¿Qué programas de la {cap} tuvieron más ejecución en {anio}?", "Principales partidas de la {cap} {anio}"],
+}
+JSON_ENDPOINTS = {"drilldown", "stats"}
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    v = sorted(valores)
+    k = min(int(round(p / 100 * (len(v) - 1))), len(v) - 1)
+    return v[k]
+
+def _parse_mezcla(texto):
+    mezcla = {}
+    for parte in texto.split(","):
+        tipo, _, peso = parte.partition("=")
+        tipo = tipo.strip()
+        if tipo not in PLANTILLAS and tipo not in JSON_ENDPOINTS:
+            raise SystemExit(f"tipo desconocido en --mezcla: {tipo}")
+        mezcla[tipo] = float(peso or 1)
+    return mezcla
+
+def _siguiente(mezcla, anios, rng):
+    tipo = rng.choices(list(mezcla), weights=list(mezcla.values()))[0]
+    anio = rng.choice(anios)
+    cap = rng.choice(CAPITULOS)
+    if tipo == "drilldown":
+        return tipo, "GET", "/drilldown", {"anio": anio, "capitulo": cap.lower()}
+    if tipo == "stats":
+        return tipo, "GET", "/stats", None
+    pregunta = rng.choice(PLANTILLAS[tipo]).format(anio=anio, anio2=anio - 1, cap=cap)
+    return tipo, "POST", "/ask", {"question": pregunta}
+
+async def _worker(cliente, mezcla, anios, fin, max_req, resultados, rng):
+    while time.perf_counter() < fin and (max_req is None or len(resultados) < max_req):
+        tipo, metodo, path, datos = _siguiente(mezcla, anios, rng)
+        t0 = time.perf_counter()
+        try:
+            if metodo == "POST":
+                r = await cliente.post(path, data=datos)
+            else:
+                r = await cliente.get(path, params=datos)
+            ruta = r.headers.get("X-Ruta", path.strip("/"))
+            ok = r.status_code < 500
+            estado = r.status_code
+        except Exception as e:
+            ruta, ok, estado = path.strip("/"), False, type(e).__name__
+        resultados.append({"tipo": tipo, "ruta": ruta, "ok": ok, "estado": estado, "seg": time.perf_counter() - t0})
+
+def _reporte(resultados, duracion):
+    grupos = {}
+    for r in resultados:
+        grupos.setdefault(r["ruta"], []).append(r)
+    grupos["TOTAL"] = resultados
+    filas = []
+    for ruta, rs in grupos.items():
+        lat = [r["seg"] * 1000 for r in rs]
+        errores = sum(1 for r in rs if not r["ok"])
+        filas.append({
+            "ruta": ruta,
+            "n": len(rs),
+            "rps": len(rs) / duracion if duracion else 0.0,
+            "p50_ms": _percentil(lat, 50),
+            "p95_ms": _percentil(lat, 95),
+            "p99_ms": _percentil(lat, 99),
+            "error_pct": 100.0 * errores / len(rs) if rs else 0.0,
+        })
+    return filas
+
+def _imprimir(filas, duracion, concurrencia):
+    print(f"\n📊 Duración {duracion:.1f}s | concurrencia {concurrencia}")
+    print(f"{'ruta':<12}{'n':>7}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'error %':>9}")
+    for f in filas:
+        print(f"{f['ruta']:<12}{f['n']:>7}{f['rps']:>9.2f}{f['p50_ms']:>10.0f}{f['p95_ms']:>10.0f}{f['p99_ms']:>10.0f}{f['error_pct']:>9.1f}")
+
+async def run(url, concurrencia, duracion, max_req, mezcla, anios, timeout, semilla):
+    resultados = []
+    limites = httpx.Limits(max_connections=concurrencia, max_keepalive_connections=concurrencia)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limites) as cliente:
+        t0 = time.perf_counter()
+        fin = t0 + duracion
+        await asyncio.gather(*[
+            _worker(cliente, mezcla, anios, fin, max_req, resultados, random.Random(semilla + i))
+            for i in range(concurrencia)
+        ])
+        total = time.perf_counter() - t0
+    return _reporte(resultados, total), total
+
+def main():
+    p = argparse.ArgumentParser(description="Prueba de carga para /ask")
+    p.add_argument("--url", default="http://127.0.0.1:8000")
+    p.add_argument("--concurrencia", type=int, default=8)
+    p.add_argument("--duracion", type=float, default=30.0, help="segundos")
+    p.add_argument("--requests", type=int, default=None, help="detener tras N requests")
+    p.add_argument("--mezcla", default="trimestral=3,anual=3,mensual=2,desglose=1,semantico=1")
+    p.add_argument("--anios", default="2022,2023,2024")
+    p.add_argument("--timeout", type=float, default=120.0)
+    p.add_argument("--semilla", type=int, default=0)
+    p.add_argument("--json", help="guardar el reporte en este archivo")
+    args = p.parse_args()
+
+    anios = [int(a) for a in args.anios.split(",")]
+    filas, total = asyncio.run(run(args.url, args.concurrencia, args.duracion, args.requests,
+                                   _parse_mezcla(args.mezcla), anios, args.timeout, args.semilla))
+    _imprimir(filas, total, args.concurrencia)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"duracion_s": total, "concurrencia": args.concurrencia, "rutas": filas}, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,38 @@
 from fastapi import FastAPI, Request, Form
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import uvicorn
 
 import os
 import re
+import json
+import asyncio
 import traceback
+import pandas as pd
 from dotenv import load_dotenv
-from openai import OpenAI
 
 from etl_normalize import normalize_csvs
 
 # === NUEVO: ETL + Analytics determinístico ===
 from etl_normalize import normalize_csvs
-from analytics import (
-    totales_trimestrales,
-    totales_anuales,
-    serie_mensual,
-    desglose_por_denominacion,
-)
+import analytics
+import analytics_sql  # backend alternativo en SQLite (ANALYTICS_BACKEND=sqlite)
+from analytics import construir_jerarquia, expandir_nodo
 
 # === EXISTENTE: embeddings (fallback) ===
-from loader import load_embeddings
+from loader import load_embeddings, attach_shared
 from preprocess_embeddings import search_semantic  # fallback semántico
+from prompt_encoding import encode_table, ESCALAS, PROMPT_UNIDAD
+from backends import get_backend
+from profiling import perfilar, modo_desde_headers, PROFILE_ROUTE
+from cache_semantico import CacheSemantico, CACHE_SEMANTICO, umbral_para
 
 app = FastAPI()
 
 load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-client = OpenAI(api_key=api_key)
+backend = get_backend()  # OpenAI o local determinístico (LLM_BACKEND=local, sin red)
+print(f"🔌 Backend de embeddings/completions: {backend.nombre}")
 
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory=".")
@@ -37,6 +40,19 @@ templates = Jinja2Templates(directory=".")
 # === GLOBALS ===
 documentos_global = []
 df_canonico = None  # DataFrame normalizado de todos los CSV
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "pandas")  # "pandas" | "sqlite"
+motor = analytics_sql if ANALYTICS_BACKEND == "sqlite" else analytics
+datos_analitica = None  # df_canonico (pandas) o ruta de la base SQLite
+COMPARACIONES_SIN_LLM = os.getenv("COMPARACIONES_SIN_LLM", "1") == "1"  # comparaciones anuales con variaciones ya calculadas
+jerarquia_global = None  # rollups subtítulo → ítem → asignación (drilldown)
+data_version = 0  # se incrementa en cada carga de datos (invalida claves de coalescencia/cache)
+
+# coalescencia (single-flight) de preguntas idénticas concurrentes
+_en_vuelo = {}  # clave de plan → asyncio.Task pendiente
+coalescencia_stats = {"ejecutadas": 0, "coalescidas": 0}
+
+# cache de respuestas por similitud de la pregunta (mismo plan + coseno >= CACHE_SIMILITUD)
+cache_respuestas = CacheSemantico(umbral=umbral_para(backend.nombre)) if CACHE_SEMANTICO else None
 
 # ---------- helpers intención/scope ----------
 def _detect_intents(q: str):
@@ -46,6 +62,7 @@ def _detect_intents(q: str):
         "annual": any(w in qn for w in ["total", "anual", "año", "compar"]),
         "monthly": any(w in qn for w in ["mensual", "mes a mes", "evolución mensual", "evolucion mensual"]),
         "breakdown": any(w in qn for w in ["denominacion", "denominación", "glosa", "detalle", "desglose"]),
+        "comparison": any(w in qn for w in ["compar", "variación", "variacion", "diferencia", " vs", "versus", "crec", "aument", "dismin"]),
     }
 
 def _build_scope(q: str):
@@ -93,13 +110,9 @@ def _build_scope(q: str):
     return scope
 
 def _summarize_df_for_prompt(df):
-    # tabla compacta para GPT (máximo ~30 filas para no inflar prompt)
+    # tabla compacta para GPT (presupuesto de tokens; filas menores se agrupan en "otros")
     try:
-        if len(df) > 30:
-            head = df.head(15).to_string(index=False)
-            tail = df.tail(15).to_string(index=False)
-            return f"{head}\n...\n{tail}\n(filas: {len(df)})"
-        return df.to_string(index=False)
+        return encode_table(df)
     except Exception:
         return str(df)
 
@@ -116,51 +129,88 @@ Pregunta:
 
 Instrucciones:
 - Explica brevemente los resultados (variaciones, tendencias).
-- Si corresponde, entrega diferencia absoluta y variación % entre periodos.
+- Las diferencias y variaciones % ya están en la tabla (columnas var_*, *_pct): cítalas, no las calcules.
+- Las variaciones anuales comparan cada año con anio_base (el año anterior disponible en la tabla, no necesariamente el inmediatamente anterior): nómbralo.
 - Si la tabla no permite responder algo, dilo explícitamente.
 """
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "system", "content": system_prompt}],
-    )
-    return completion.choices[0].message.content.strip()
+    return backend.complete(system_prompt, model=model)
+
+def _fmt_monto(v):
+    return f"{v / ESCALAS.get(PROMPT_UNIDAD, 1):,.2f} {PROMPT_UNIDAD}"
+
+def _respuesta_comparacion(df_res, col, etiqueta):
+    """
+    Comparación entre años sin LLM: las variaciones (var_anual, var_anual_pct) ya vienen en la tabla,
+    contra el año anterior presente en ella (anio_base). None si hay menos de dos años (se narra con el modelo).
+    """
+    if "var_anual" not in df_res.columns or df_res["var_anual"].notna().sum() == 0:
+        return None
+    lineas = [f"{etiqueta} ({PROMPT_UNIDAD}, cifras calculadas en Python):"]
+    for r in df_res.itertuples(index=False):
+        linea = f"- {int(r.anio)}: {_fmt_monto(getattr(r, col))}"
+        if pd.notna(r.var_anual):
+            pct = "" if pd.isna(r.var_anual_pct) else f", {r.var_anual_pct:+.1f}%"
+            linea += f" ({'+' if r.var_anual >= 0 else '-'}{_fmt_monto(abs(r.var_anual))}{pct} vs {int(r.anio_base)})"
+        lineas.append(linea)
+    return "\n".join(lineas)
 
 # ---------- enrutador principal ----------
-def route_and_answer(question: str) -> str:
+def _elegir_ruta(intents):
+    """Ruta que toma route_and_answer (en orden de prioridad); expuesta en el header X-Ruta de /ask."""
+    if datos_analitica is not None:
+        for ruta, intent in (("trimestral","quarterly"), ("anual","annual"), ("mensual","monthly"), ("desglose","breakdown")):
+            if intents[intent]:
+                return ruta
+    return "semantico"
+
+def route_and_answer(question: str, perfil: str = "") -> str:
+    """perfil: "sample" | "cprofile" para perfilar esta llamada (por defecto PROFILE_ROUTE)."""
+    modo = perfil or PROFILE_ROUTE
+    if not modo:
+        return _route_and_answer(question)
+    with perfilar(f"ask_{question}", modo):
+        return _route_and_answer(question)
+
+def _route_and_answer(question: str) -> str:
     global df_canonico, documentos_global
 
     intents = _detect_intents(question)
     scope = _build_scope(question)
+    ruta = _elegir_ruta(intents)
 
-    print(f"🧭 intents={intents} | scope={scope}")
+    print(f"🧭 intents={intents} | scope={scope} | ruta={ruta}")
 
     # 1) Trimestral
-    if intents["quarterly"] and df_canonico is not None:
-        df_res = totales_trimestrales(df_canonico, scope)
+    if ruta == "trimestral":
+        df_res = motor.totales_trimestrales(datos_analitica, scope)
         print("🔢 trimestral\n", df_res)
         if df_res.empty:
             return "No se encontraron datos trimestrales para ese alcance/periodo."
         return _answer_with_gpt("gpt-5", _summarize_df_for_prompt(df_res), question)
 
     # 2) Anual (totales con Q4/diciembre)
-    if intents["annual"] and df_canonico is not None:
-        df_res = totales_anuales(df_canonico, scope)
+    if ruta == "anual":
+        df_res = motor.totales_anuales(datos_analitica, scope)
         print("🔢 anual\n", df_res)
         if df_res.empty:
             return "No se encontraron datos anuales para ese alcance/periodo."
+        if COMPARACIONES_SIN_LLM and intents["comparison"]:
+            directa = _respuesta_comparacion(df_res, "total_anual", "Ejecución anual (cierre a diciembre)")
+            if directa:
+                return directa
         return _answer_with_gpt("gpt-5", _summarize_df_for_prompt(df_res), question)
 
     # 3) Mensual (acumulado a cada mes)
-    if intents["monthly"] and df_canonico is not None:
-        df_res = serie_mensual(df_canonico, scope)
+    if ruta == "mensual":
+        df_res = motor.serie_mensual(datos_analitica, scope)
         print("🔢 mensual\n", df_res)
         if df_res.empty:
             return "No se encontraron datos mensuales para ese alcance/periodo."
         return _answer_with_gpt("gpt-5", _summarize_df_for_prompt(df_res), question)
 
     # 4) Desglose por denominación (top)
-    if intents["breakdown"] and df_canonico is not None:
-        df_res = desglose_por_denominacion(df_canonico, scope, top=20, periodo="anual")
+    if ruta == "desglose":
+        df_res = motor.desglose_por_denominacion(datos_analitica, scope, top=20, periodo="anual")
         print("🔢 desglose\n", df_res.head(5))
         if df_res.empty:
             return "No se encontraron denominaciones para ese alcance/periodo."
@@ -168,42 +218,189 @@ def route_and_answer(question: str) -> str:
 
     # 5) Fallback semántico (lo que ya tenías, con embeddings)
     #    -> útil para preguntas abiertas, comparativas texto, etc.
-    return search_semantic(client, documentos_global, question)
+    return search_semantic(backend, documentos_global, question)
+
+# ---------- coalescencia de preguntas concurrentes ----------
+def _clave_plan(question: str):
+    """Clave del plan normalizado: intents + scope + pregunta (minúsculas, espacios colapsados) + versión de datos."""
+    plan = {
+        "intents": _detect_intents(question),
+        "scope": _build_scope(question),
+        "q": " ".join(question.lower().split()),
+    }
+    return json.dumps(plan, sort_keys=True, ensure_ascii=False), data_version
+
+# ---------- cache semántico de respuestas ----------
+def _clave_cache(question: str, ruta: str):
+    """Plan sin el texto de la pregunta (ruta + intents + scope) + versión de datos: las paráfrasis comparten grupo."""
+    plan = {"ruta": ruta, "intents": _detect_intents(question), "scope": _build_scope(question)}
+    return json.dumps(plan, sort_keys=True, ensure_ascii=False), data_version
+
+def _responder_con_cache(question: str) -> str:
+    ruta = _elegir_ruta(_detect_intents(question))
+    # el semántico elige documentos por el embedding de la pregunta: su respuesta no depende solo del plan
+    if cache_respuestas is None or ruta == "semantico":
+        return route_and_answer(question)
+    clave = _clave_cache(question, ruta)
+    respuesta = cache_respuestas.buscar_exacta(clave, question)
+    if respuesta is not None:
+        print("♻️ Respuesta desde cache (pregunta idéntica)")
+        return respuesta
+    try:
+        emb = backend.embed(question)
+    except Exception as e:
+        print(f"⚠️ No se pudo calcular el embedding de la pregunta (sin cache): {e}")
+        return route_and_answer(question)
+    respuesta = cache_respuestas.buscar(clave, question, emb)
+    if respuesta is not None:
+        print("♻️ Respuesta desde cache (pregunta similar con el mismo scope)")
+        return respuesta
+    respuesta = route_and_answer(question)
+    cache_respuestas.guardar(clave, question, emb, respuesta)
+    return respuesta
+
+async def answer_coalesced(question: str) -> str:
+    """
+    Si ya hay una pregunta con el mismo plan en curso, espera ese resultado en vez de
+    lanzar otro cálculo/completion. La pregunta (cache semántico + route_and_answer) corre en un thread.
+    """
+    clave = _clave_plan(question)
+    tarea = _en_vuelo.get(clave)
+    if tarea is not None:
+        coalescencia_stats["coalescidas"] += 1
+        print(f"🔗 Pregunta coalescida con una en curso ({coalescencia_stats['coalescidas']} en total)")
+    else:
+        coalescencia_stats["ejecutadas"] += 1
+        tarea = asyncio.ensure_future(asyncio.to_thread(_responder_con_cache, question))
+        _en_vuelo[clave] = tarea
+        tarea.add_done_callback(lambda _t: _en_vuelo.pop(clave, None))
+    # shield: si un cliente se desconecta no se cancela el cálculo que esperan los demás
+    return await asyncio.shield(tarea)
 
 # ---------- FastAPI ----------
 @app.on_event("startup")
 async def startup_event():
-    global documentos_global, df_canonico
-    print("Cargando embeddings (para fallback) y normalizando CSV...")
-
-    # ✅ pass the client
-    documentos_global = load_embeddings(client, force_recalculate=False)
+    global documentos_global, df_canonico, data_version
 
+    # Si el paso de carga (`python loader.py`) ya publicó los datos, solo adjuntar (mmap)
     try:
-        df_canonico = normalize_csvs("data")  # lee TODOS los CSV disponibles
-        print(f"✅ DF canónico cargado: {len(df_canonico)} filas")
+        shared_df, shared_docs = attach_shared(backend_nombre=backend.nombre)
     except Exception as e:
-        print(f"⚠️ No se pudo normalizar CSV (se usará solo el flujo semántico): {e}")
-        df_canonico = None
+        print(f"⚠️ No se pudo adjuntar a los datos compartidos (se recalculan en este worker): {e}")
+        shared_df, shared_docs = None, None
+    if shared_docs is not None:
+        documentos_global = shared_docs
+        df_canonico = shared_df
+    else:
+        print("Cargando embeddings (para fallback) y normalizando CSV...")
+
+        documentos_global = load_embeddings(backend, force_recalculate=False)
+
+        if ANALYTICS_BACKEND == "sqlite" and analytics_sql.vigente(analytics_sql.ANALYTICS_DB, "data"):
+            df_canonico = None  # ya está en disco y al día con los CSV: no se carga en RAM
+        else:
+            try:
+                df_canonico = normalize_csvs("data")  # lee TODOS los CSV disponibles
+                print(f"✅ DF canónico cargado: {len(df_canonico)} filas")
+            except Exception as e:
+                print(f"⚠️ No se pudo normalizar CSV (se usará solo el flujo semántico): {e}")
+                df_canonico = None
+
+    _preparar_analitica()
+    _cargar_jerarquia()
+    data_version += 1
+    if cache_respuestas is not None:
+        cache_respuestas.invalidar()  # respuestas calculadas con los datos anteriores
+
+def _preparar_analitica():
+    global datos_analitica, df_canonico
+    if ANALYTICS_BACKEND != "sqlite":
+        datos_analitica = df_canonico
+        return
+    db = analytics_sql.ANALYTICS_DB
+    try:
+        huella = analytics_sql.huella_csvs("data")
+        if analytics_sql.huella_sqlite(db) != huella:
+            if df_canonico is not None and not df_canonico.empty:
+                analytics_sql.publicar_sqlite(df_canonico, db, huella=huella)
+            elif os.path.exists(db):
+                print(f"⚠️ {db} no corresponde a los CSV actuales y no se pudo regenerar (se usa igual)")
+        datos_analitica = db if os.path.exists(db) else None
+        print(f"✅ Analytics en SQLite: {datos_analitica}")
+    except Exception as e:
+        print(f"⚠️ No se pudo preparar la base SQLite (se usará solo el flujo semántico): {e}")
+        datos_analitica = None
+    df_canonico = None  # las consultas van a SQLite (filtros de scope empujados al WHERE)
+
+def _cargar_jerarquia():
+    global jerarquia_global
+    jerarquia_global = None
+    if datos_analitica is None:
+        return
+    scope = {"incluir_ingresos": False}
+    try:
+        if ANALYTICS_BACKEND == "sqlite":
+            # agregados por nodo calculados en SQLite (no se traen las filas a RAM)
+            jer = analytics_sql.construir_jerarquia(datos_analitica, scope=scope, top=20)
+        else:
+            if df_canonico.empty:
+                return
+            jer = construir_jerarquia(df_canonico, scope=scope, top=20)
+        if not jer["nodos"]:
+            return
+        jerarquia_global = jer
+        print(f"✅ Jerarquía del clasificador: {len(jerarquia_global['nodos'])} nodos")
+    except Exception as e:
+        print(f"⚠️ No se pudo construir la jerarquía (drilldown deshabilitado): {e}")
 
 @app.get("/", response_class=HTMLResponse)
 async def get_form(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request, "response": ""})
+    return templates.TemplateResponse(request, "index.html", {"response": ""})
+
+def _respuesta_ask(request, response, ruta, status_code=200):
+    # X-Ruta: ruta tomada por route_and_answer (la usa loadtest.py para agrupar latencias)
+    resp = templates.TemplateResponse(request, "index.html", {"response": response})
+    resp.status_code = status_code
+    resp.headers["X-Ruta"] = ruta
+    return resp
 
 @app.post("/ask", response_class=HTMLResponse)
 async def ask_question(request: Request, question: str = Form(...)):
+    ruta = "vacia"
     try:
         if not question.strip():
-            return templates.TemplateResponse("index.html", {"request": request, "response": "La pregunta no puede estar vacía."})
+            return _respuesta_ask(request, "La pregunta no puede estar vacía.", ruta)
 
         print(f"➡️ Pregunta recibida: {question}")
-        response = route_and_answer(question)
+        ruta = _elegir_ruta(_detect_intents(question))
+        perfil = modo_desde_headers(request.headers)  # X-Profile, solo admins (X-Admin-Token)
+        if perfil:
+            # perfilada: se ejecuta aparte para no coalescerla con otras
+            response = await asyncio.to_thread(route_and_answer, question, perfil)
+        else:
+            response = await answer_coalesced(question)
         print(f"✅ Respuesta generada: {response[:200]}...")
-        return templates.TemplateResponse("index.html", {"request": request, "response": response})
+        return _respuesta_ask(request, response, ruta)
     except Exception as e:
         print(f"❌ Error procesando la pregunta: {str(e)}")
         traceback.print_exc()
-        return templates.TemplateResponse("index.html", {"request": request, "response": f"Error procesando la pregunta: {str(e)}"})
+        return _respuesta_ask(request, f"Error procesando la pregunta: {str(e)}", ruta, status_code=500)
+
+@app.get("/drilldown")
+async def drilldown(anio: int, capitulo: str = "", programa: str = "", ruta: str = ""):
+    """Expande un nodo del clasificador (ruta "22.04" → asignaciones del ítem 04 del subtítulo 22)."""
+    if jerarquia_global is None:
+        return JSONResponse({"error": "Jerarquía no disponible."}, status_code=503)
+    df_res = expandir_nodo(jerarquia_global, (anio, capitulo, programa), ruta.split(".") if ruta else ())
+    return JSONResponse(df_res.to_dict(orient="records"))
+
+@app.get("/stats")
+async def stats():
+    return JSONResponse({
+        "data_version": data_version,
+        "coalescencia": {**coalescencia_stats, "en_vuelo": len(_en_vuelo)},
+        "cache_semantico": cache_respuestas.resumen() if cache_respuestas is not None else None,
+    })
 
 if __name__ == "__main__":
     uvicorn.run("main:app", host="127.0.0.1", port=8000, reload=True)
@@ -5,6 +5,10 @@ import re
 import io
 import csv
 import numpy as np
+import pandas as pd
+from analytics import _desacumular, _con_variacion_anual, _con_variaciones_periodo
+from etl_normalize import sniff_delim_registrado, mapeo_columnas
+from prompt_encoding import encode_table, estimar_tokens, PROMPT_TOKEN_BUDGET
 
 def _norm(s: str) -> str:
     if s is None: return ""
@@ -39,9 +43,9 @@ def ingest_documents(data_folder):
 # ---------------------------
 # 2) Embeddings
 # ---------------------------
-def get_embedding(client, text, model="text-embedding-3-small"):
-    resp = client.embeddings.create(model=model, input=text)
-    return resp.data[0].embedding
+def get_embedding(backend, text, model=None):
+    """backend: ver backends.py (OpenAI o local determinístico)."""
+    return backend.embed(text, model=model)
 
 def cosine_similarity(vec1, vec2):
     v1 = np.array(vec1, dtype=float)
@@ -56,14 +60,6 @@ MESES = ["enero","febrero","marzo","abril","mayo","junio",
          "julio","agosto","septiembre","octubre","noviembre","diciembre"]
 TRIM_CIERRE = {1:"marzo", 2:"junio", 3:"septiembre", 4:"diciembre"}
 
-def _sniff_delimiter(sample: str) -> str:
-    try:
-        dialect = csv.Sniffer().sniff(sample, delimiters=";,|\t")
-        return dialect.delimiter
-    except Exception:
-        counts = {d: sample.count(d) for d in [";",";",",","\t","|"]}
-        return max(counts, key=counts.get)
-
 def _to_float(x):
     if x is None: return 0.0
     s = str(x).strip().replace("\u00a0","")
@@ -95,47 +91,10 @@ def _infer_period_from_name_path_headers(doc_name: str, doc_path: str, headers):
                     return {"period_type":"month", "month": mes, "mes_cierre": mes}
     return {"period_type": None, "mes_cierre": None}
 
-def _score_header_for_exec(h: str, period_hint: dict):
-    h0 = _norm(h)
-    score = 0
-    if "ejec" in h0: score += 2
-    if "acumul" in h0: score += 2
-    if "ejecutado" in h0: score += 2
-    if "devengado" in h0: score += 1
-    if "monto" in h0 and ("ejec" in h0 or "ejecut" in h0): score += 1
-    if period_hint:
-        if period_hint.get("period_type") == "quarter":
-            q = period_hint.get("quarter")
-            if q and f"q{q}" in h0: score += 2
-            word = {1:"primer", 2:"segundo", 3:"tercer", 4:"cuarto"}.get(q)
-            if word and "trimestre" in h0 and word in h0: score += 2
-        mes = period_hint.get("mes_cierre")
-        if mes:
-            if mes in h0: score += 2
-            if mes[:3] in h0: score += 1
-    if "vigente" in h0 or "presupuesto" in h0: score -= 2
-    return score
-
-def _choose_exec_col(headers, period_hint):
-    if not headers: return None
-    best, best_score = None, -999
-    for h in headers:
-        sc = _score_header_for_exec(h, period_hint)
-        if sc > best_score:
-            best, best_score = h, sc
-    if best is None:
-        # último recurso
-        for h in headers:
-            h0 = _norm(h)
-            if "total" in h0 or "vigente" in h0 or "presupuesto" in h0:
-                return h
-    return best
-
 def sum_csv_doc(doc, annual_hint=False):
     """Suma ejecución del documento → usa mejor columna; filtra a GASTO 21–34 si hay subtítulo."""
     # prepara lector
-    sample = doc["contenido"][:5000]
-    delim = _sniff_delimiter(sample)
+    delim = sniff_delim_registrado(doc["contenido"], registrar=False)
     f = io.StringIO(doc["contenido"])
     reader = csv.DictReader(f, delimiter=delim)
     headers = reader.fieldnames or []
@@ -145,19 +104,15 @@ def sum_csv_doc(doc, annual_hint=False):
         # si es anual y no hay periodo → asumir diciembre (total)
         period_hint = {"period_type":"month", "month":"diciembre", "mes_cierre":"diciembre"}
 
-    exec_col = _choose_exec_col(headers, period_hint)
-
-    # columna subtítulo para filtrar GASTO
-    sub_col = None
-    if headers:
-        for h in headers:
-            h0 = _norm(h)
-            if "subt" in h0: sub_col = h; break
-
     total = 0.0
     if not headers:
         return 0.0
 
+    # columna de ejecución + subtítulo (para filtrar GASTO), compartidas con el ETL vía registro
+    mapeo = mapeo_columnas(delim, headers, period_hint, registrar=False)  # consulta: solo lectura
+    exec_col = mapeo["exec"]
+    sub_col = mapeo["subtitulo"]
+
     for row in reader:
         # filtra gasto por subtítulo
         if sub_col:
@@ -215,7 +170,7 @@ def _match_priority(nombre: str) -> bool:
 # ---------------------------
 # 5) Búsqueda + agregación en Python (fallback)
 # ---------------------------
-def search_semantic(client, docs, query, model="gpt-4-turbo"):
+def search_semantic(backend, docs, query, model="gpt-4-turbo"):
     years = sorted(set(re.findall(r"\b(20[0-9]{2})\b", query)))
     q = query.lower()
     annual_hint = any(w in q for w in ["total", "anual", "año", "compar", "ejecución total", "ejecucion total"])
@@ -243,8 +198,8 @@ def search_semantic(client, docs, query, model="gpt-4-turbo"):
                 if d not in must: must.append(d)
     must = list({id(d): d for d in must}.values())
 
-    query_emb = get_embedding(client, query)
-    resto = [d for d in docs_year if d not in must and d.get("embedding")]
+    query_emb = get_embedding(backend, query)
+    resto = [d for d in docs_year if d not in must and len(d.get("embedding", [])) > 0]
     ranked_resto = sorted(resto, key=lambda d: cosine_similarity(d["embedding"], query_emb), reverse=True)
 
     adicionales = ranked_resto[:max(0, 40 - len(must))]
@@ -273,8 +228,7 @@ def search_semantic(client, docs, query, model="gpt-4-turbo"):
                 # sumar (sin forzar anual_hint)
                 tot = sum_csv_doc(d, annual_hint=False)
                 # inferir periodo para mapear a trimestre de cierre
-                sample = d["contenido"][:5000]
-                delim = _sniff_delimiter(sample)
+                delim = sniff_delim_registrado(d["contenido"], registrar=False)
                 r = csv.DictReader(io.StringIO(d["contenido"]), delimiter=delim)
                 headers = r.fieldnames or []
                 ph = _infer_period_from_name_path_headers(d.get("nombre"), d.get("ruta"), headers)
@@ -288,15 +242,15 @@ def search_semantic(client, docs, query, model="gpt-4-turbo"):
             return acc
 
         scope_caps = wanted_capitulos[:]  # ej. ["sec"]
-        lines = []
-        for y in target_years:
-            acc = _accum(docs_year, y, scope_caps)
-            q1 = acc[1]
-            q2 = max(acc[2]-acc[1], 0.0)
-            q3 = max(acc[3]-acc[2], 0.0)
-            q4 = max(acc[4]-acc[3], 0.0)
-            lines.append(f"AÑO {y}: Q1={q1:,.2f} | Q2={q2:,.2f} | Q3={q3:,.2f} | Q4={q4:,.2f}")
-        summary_text = "\n".join(lines)
+        acc = pd.DataFrame.from_dict({y: _accum(docs_year, y, scope_caps) for y in target_years}, orient="index")
+        flujos = pd.DataFrame(columns=["anio","Q1","Q2","Q3","Q4"])
+        if not acc.empty:
+            flujos = _desacumular(acc.reindex(columns=list(TRIM_CIERRE)))
+            flujos = flujos.rename(columns={q: f"Q{q}" for q in TRIM_CIERRE}).rename_axis("anio").reset_index()
+            flujos["anio"] = pd.to_numeric(flujos["anio"], errors="coerce")  # años de los documentos vienen como texto
+            flujos["total"] = acc[max(TRIM_CIERRE)].where(acc[max(TRIM_CIERRE)] > 0).to_numpy(dtype="float64")  # cierre Q4
+            flujos = _con_variaciones_periodo(flujos, ["anio"], "trimestral")
+        summary_text = encode_table(flujos)
         system_prompt = f"""Eres un analista presupuestario.
 Usa EXCLUSIVAMENTE los totales trimestrales calculados en Python (Q1=marzo, Q2=junio, Q3=septiembre, Q4=diciembre).
 No inventes ni reestimes.
@@ -308,14 +262,10 @@ Pregunta:
 {query}
 
 Instrucciones:
-- Describe la variación entre trimestres con cifras y %.
+- Describe la variación entre trimestres y entre años citando las columnas *_pct y var_* ya calculadas (las anuales son contra anio_base; no las recalcules).
 - Si un trimestre está ausente (0.0), indícalo como falta de datos.
 """
-        completion = client.chat.completions.create(
-            model=model,
-            messages=[{"role": "system", "content": system_prompt}]
-        )
-        return completion.choices[0].message.content.strip()
+        return backend.complete(system_prompt, model=model)
 
     # Anual: suma directa (con filtro a Q4 si tocaba)
     per_year = {y: 0.0 for y in target_years}
@@ -328,15 +278,13 @@ Instrucciones:
         per_year[y] += tot
         per_year_details[y].append({"archivo": d["nombre"], "total_doc": tot})
 
-    resumen = []
-    for y in target_years:
-        resumen.append(f"AÑO {y}: TOTAL = {per_year[y]:,.2f}")
-        dets = per_year_details[y]
-        for it in dets[:8]:
-            resumen.append(f"  - {it['archivo']}: {it['total_doc']:,.2f}")
-        if len(dets) > 8:
-            resumen.append(f"  - (+{len(dets)-8} archivos más)")
-    summary_text = "\n".join(resumen)
+    totales = pd.DataFrame({"anio": target_years, "total": [per_year[y] for y in target_years]})
+    totales = _con_variacion_anual(totales.assign(anio=pd.to_numeric(totales["anio"], errors="coerce")), "total")
+    detalle = pd.DataFrame([{"anio": y, **it} for y in target_years for it in per_year_details[y]],
+                           columns=["anio","archivo","total_doc"])
+    texto_totales = encode_table(totales)
+    texto_detalle = encode_table(detalle, presupuesto=max(PROMPT_TOKEN_BUDGET - estimar_tokens(texto_totales), 100))
+    summary_text = f"{texto_totales}\n\nDetalle por archivo\n{texto_detalle}"
 
     system_prompt = f"""Eres un analista presupuestario.
 Usa EXCLUSIVAMENTE los totales anuales calculados en Python (cierre en diciembre para evitar doble conteo).
@@ -349,11 +297,7 @@ Pregunta:
 {query}
 
 Instrucciones:
-- Si hay 2 años, da diferencia absoluta y %.
+- Si hay 2 años, cita la diferencia (var_anual) y el % (var_anual_pct) ya calculados contra anio_base (nómbralo); no los recalcules.
 - Si faltan cierres de año, adviértelo.
 """
-    completion = client.chat.completions.create(
-        model=model,
-        messages=[{"role": "system", "content": system_prompt}]
-    )
-    return completion.choices[0].message.content.strip()
+    return backend.complete(system_prompt, model=model)
@@ -0,0 +1,114 @@
+# profiling.py
+"""
+Perfilado opt-in de una llamada a route_and_answer o de un archivo en normalize_csvs.
+Modos: "sample" (muestreo de stacks → .folded, formato de flamegraph.pl / speedscope / inferno)
+       "cprofile" (determinístico → .pstats, para snakeviz / flameprof).
+Desactivado (modo vacío) devuelve un nullcontext: no agrega costo.
+"""
+import os
+import re
+import hmac
+import itertools
+import sys
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_ROUTE = os.getenv("PROFILE_ROUTE", "")        # perfila TODAS las preguntas (modo)
+PROFILE_ETL = os.getenv("PROFILE_ETL", "")            # perfila archivos del ETL (modo)
+PROFILE_ETL_FILTRO = os.getenv("PROFILE_ETL_FILTRO", "")  # solo rutas que contengan este texto
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+MODOS = ("sample", "cprofile")
+_secuencia = itertools.count()  # desempata perfiles del mismo milisegundo
+TOP = 15
+
+def modo_valido(modo):
+    modo = (modo or "").strip().lower()
+    return modo if modo in MODOS else ""
+
+def modo_desde_headers(headers):
+    """Header X-Profile (sample|cprofile), solo si X-Admin-Token coincide con ADMIN_TOKEN."""
+    token = headers.get("x-admin-token") or ""
+    if not ADMIN_TOKEN or not hmac.compare_digest(token.encode("utf-8"), ADMIN_TOKEN.encode("utf-8")):
+        return ""
+    return modo_valido(headers.get("x-profile"))
+
+def _archivo_salida(nombre, ext):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = re.sub(r"[^A-Za-z0-9_.-]+", "_", nombre)[:80].strip("_") or "perfil"
+    ahora = time.time()
+    sello = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(ahora))}.{int(ahora * 1000) % 1000:03d}-{os.getpid()}-{next(_secuencia)}"
+    return os.path.join(PROFILE_DIR, f"{sello}_{base}.{ext}")
+
+def _marco(f):
+    return f"{os.path.basename(f.f_code.co_filename)}:{f.f_code.co_name}"
+
+@contextmanager
+def _muestreo(nombre):
+    objetivo = threading.get_ident()
+    stacks = Counter()
+    fin = threading.Event()
+
+    def _muestrear():
+        while not fin.wait(PROFILE_INTERVAL_MS / 1000):
+            f = sys._current_frames().get(objetivo)
+            pila = []
+            while f is not None:
+                pila.append(_marco(f))
+                f = f.f_back
+            if pila:
+                stacks[";".join(reversed(pila))] += 1
+
+    hilo = threading.Thread(target=_muestrear, daemon=True)
+    t0 = time.perf_counter()
+    hilo.start()
+    try:
+        yield
+    finally:
+        fin.set()
+        hilo.join()
+        ruta = _archivo_salida(nombre, "folded")
+        with open(ruta, "w", encoding="utf-8") as f:
+            for pila, n in stacks.most_common():
+                f.write(f"{pila} {n}\n")
+        propio = Counter()
+        for pila, n in stacks.items():
+            propio[pila.rsplit(";", 1)[-1]] += n
+        total = sum(stacks.values()) or 1
+        print(f"🔬 Perfil '{nombre}' ({time.perf_counter() - t0:.2f}s, {total} muestras) → {ruta}")
+        for fn, n in propio.most_common(TOP):
+            print(f"    {100 * n / total:5.1f}%  {fn}")
+
+@contextmanager
+def _cprofile(nombre):
+    prof = cProfile.Profile()
+    t0 = time.perf_counter()
+    prof.enable()
+    try:
+        yield
+    finally:
+        prof.disable()
+        ruta = _archivo_salida(nombre, "pstats")
+        prof.dump_stats(ruta)
+        print(f"🔬 Perfil '{nombre}' ({time.perf_counter() - t0:.2f}s) → {ruta}")
+        stats = pstats.Stats(prof).sort_stats("cumulative")
+        for (archivo, linea, fn), (_, ncalls, _, cum, _) in list(
+                sorted(stats.stats.items(), key=lambda kv: kv[1][3], reverse=True))[:TOP]:
+            print(f"    {cum:8.3f}s  {ncalls:>7}  {os.path.basename(archivo)}:{linea}:{fn}")
+
+def perfilar(nombre, modo):
+    """Context manager de perfilado; nullcontext si modo está vacío."""
+    modo = modo_valido(modo)
+    if not modo:
+        return nullcontext()
+    return _muestreo(nombre) if modo == "sample" else _cprofile(nombre)
+
+def perfilar_etl(path):
+    if not PROFILE_ETL or (PROFILE_ETL_FILTRO and PROFILE_ETL_FILTRO not in path):
+        return nullcontext()
+    return perfilar(f"etl_{os.path.basename(path)}", PROFILE_ETL)
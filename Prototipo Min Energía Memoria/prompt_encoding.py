@@ -0,0 +1,136 @@
+# prompt_encoding.py
+import os
+import pandas as pd
+
+# Presupuesto de tokens para la tabla dentro del prompt (estimación ~4 caracteres por token)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1200"))
+CHARS_POR_TOKEN = 4
+
+ESCALAS = {"MM$": 1_000_000, "M$": 1_000, "$": 1}
+PROMPT_UNIDAD = os.getenv("PROMPT_UNIDAD", "MM$")
+
+# columnas numéricas que no son montos (no se escalan ni se suman en "otros")
+COLUMNAS_NO_MONTO = {"anio", "anio_base", "mes_num", "quarter", "subtitulo", "n_hijos"}
+# columnas de periodo: si son las únicas dimensiones, la tabla es una serie de tiempo
+COLUMNAS_TIEMPO = {"anio", "anio_base", "mes_num", "mes_cierre", "quarter"}
+
+def estimar_tokens(texto: str) -> int:
+    return len(texto) // CHARS_POR_TOKEN + 1
+
+def _columnas_monto(df):
+    return [c for c in df.columns
+            if c not in COLUMNAS_NO_MONTO and not str(c).endswith("_pct")
+            and pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+
+def _sumable(col):
+    """Solo los flujos se suman en "otros": acumulados, totales y variaciones no son aditivos."""
+    c = str(col)
+    return not (c.startswith("acumulado") or c.startswith("var_") or "_var_" in c or c == "total")
+
+def _fmt(v, col, montos, escala):
+    if v is None or (not isinstance(v, str) and pd.isna(v)):
+        return ""
+    if isinstance(v, bool) or pd.api.types.is_bool(v):
+        return "sí" if v else ""
+    if col in montos:
+        return f"{v / escala:.2f}"
+    if str(col).endswith("_pct"):
+        return f"{v:.1f}%"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return str(v)
+
+def _render(df, montos, escala, unidad, total_filas, otros=None):
+    cols = list(df.columns)
+    lineas = [f"# montos en {unidad} | filas: {total_filas}", "|".join(map(str, cols))]
+    for fila in df.itertuples(index=False):
+        lineas.append("|".join(_fmt(v, c, montos, escala) for c, v in zip(cols, fila)))
+    for fila in otros or []:
+        lineas.append("|".join(fila))
+    return "\n".join(lineas)
+
+def _filas_otros(resto, cols, montos, escala, etiqueta="otros", por_anio=False):
+    """Línea(s) "otros" con la suma de los flujos del resto; por_anio: una por año (no se mezclan años)."""
+    if not por_anio:
+        return [_fila_otros(resto, cols, montos, escala, etiqueta)] if len(resto) else []
+    return [_fila_otros(g, cols, montos, escala, f"{etiqueta} {_fmt(a, 'anio', montos, escala)}")
+            for a, g in resto.groupby("anio", sort=True, dropna=False)]
+
+def _fila_otros(resto, cols, montos, escala, etiqueta="otros"):
+    etiqueta = f"{etiqueta} ({len(resto)} filas)"
+    out = []
+    for i, c in enumerate(cols):
+        if c in montos and _sumable(c):
+            out.append(_fmt(resto[c].sum(), c, montos, escala))
+        else:
+            out.append(etiqueta if i == 0 else "")
+    return out
+
+def _bloques(df, montos):
+    """
+    Filas agrupadas en bloques por prioridad (se conservan bloques completos, en orden).
+    Serie de tiempo: años completos, del más reciente al más antiguo.
+    Con montos y años (ej. desglose): cada fila, por mayor monto dentro de su año, alternando años
+    (el resto se agrupa por año). Con montos: cada fila, por mayor monto absoluto. Sin montos: en su orden.
+    Devuelve (bloques, etiqueta, por_anio).
+    """
+    dims = [c for c in df.columns if c not in montos and not str(c).endswith("_pct")
+            and not pd.api.types.is_bool_dtype(df[c])]
+    if "anio" in df.columns and set(dims) <= COLUMNAS_TIEMPO:
+        anios = df["anio"].drop_duplicates().sort_values(ascending=False, na_position="last")
+        return [df.index[(df["anio"] == a) if pd.notna(a) else df["anio"].isna()].tolist() for a in anios], "anteriores", False
+    if montos and "anio" in df.columns:
+        magnitud = df[montos[0]].abs().fillna(0)
+        rango = magnitud.groupby(df["anio"], dropna=False).rank(method="first", ascending=False)
+        orden = pd.DataFrame({"rango": rango, "anio": df["anio"]}).sort_values(["rango", "anio"], kind="stable").index
+        return [[i] for i in orden], "otros", True
+    if montos:
+        orden = df[montos[0]].abs().fillna(0).sort_values(ascending=False, kind="stable").index
+        return [[i] for i in orden], "otros", False
+    return [[i] for i in df.index], "otros", False
+
+def encode_table(df, presupuesto=None, unidad=None):
+    """
+    Tabla compacta para el prompt: delimitada por '|', montos escalados (ej. MM$), sin padding.
+    Si excede el presupuesto de tokens, conserva las filas de mayor monto (en su orden original)
+    y agrupa el resto en una línea "otros" con la suma de sus flujos, para no perder totales
+    (una por año si la tabla tiene varios años, ej. desglose por denominación).
+    Las series de tiempo se recortan por años completos (los más recientes se conservan).
+    """
+    presupuesto = presupuesto or PROMPT_TOKEN_BUDGET
+    unidad = unidad or PROMPT_UNIDAD
+    escala = ESCALAS.get(unidad, 1)
+    if df is None or len(df) == 0:
+        return "(sin filas)"
+    df = df.reset_index(drop=True)
+    montos = _columnas_monto(df)
+
+    texto = _render(df, montos, escala, unidad, len(df))
+    if estimar_tokens(texto) <= presupuesto:
+        return texto
+
+    bloques, etiqueta, por_anio = _bloques(df, montos)
+    mejor = _recortar(df, bloques, etiqueta, por_anio, presupuesto, montos, escala, unidad)
+    if mejor is None and etiqueta == "anteriores" and len(bloques[0]) > 1:
+        # ni el año más reciente cabe entero: filas más recientes primero
+        mejor = _recortar(df, [[i] for i in reversed(df.index)], etiqueta, por_anio, presupuesto, montos, escala, unidad)
+    if mejor is None:
+        mejor = _render(df.iloc[0:0], montos, escala, unidad, len(df),
+                        _filas_otros(df, list(df.columns), montos, escala, etiqueta, por_anio))
+    return mejor
+
+def _recortar(df, bloques, etiqueta, por_anio, presupuesto, montos, escala, unidad):
+    """Máximo número de bloques (en orden de prioridad) que cabe en el presupuesto; None si ninguno."""
+    lo, hi = 1, len(bloques) - 1
+    mejor = None
+    while lo <= hi:
+        n = (lo + hi) // 2
+        filas = [i for b in bloques[:n] for i in b]
+        keep = df.loc[sorted(filas)]
+        resto = df.drop(index=filas)
+        t = _render(keep, montos, escala, unidad, len(df), _filas_otros(resto, list(df.columns), montos, escala, etiqueta, por_anio))
+        if estimar_tokens(t) <= presupuesto:
+            mejor, lo = t, n + 1
+        else:
+            hi = n - 1
+    return mejor